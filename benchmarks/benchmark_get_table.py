@@ -0,0 +1,53 @@
+#
+#   Thiscovery API - THIS Institute’s citizen science platform
+#   Copyright (C) 2021 THIS Institute
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   A copy of the GNU Affero General Public License is available in the
+#   docs folder of this project.  It is also available www.gnu.org/licenses/
+#
+"""
+Measures the per-call cost of Dynamodb.get_table with and without the table handle cache.
+
+Uses the same local configuration as the test suite. Run from the repository root:
+    python -m benchmarks.benchmark_get_table
+"""
+import local.dev_config  # sets env variables TEST_ON_AWS and AWS_TEST_API
+import local.secrets  # sets env variables THISCOVERY_AFS25_PROFILE and THISCOVERY_AMP205_PROFILE
+import timeit
+
+from thiscovery_lib import dynamodb_utilities as ddb_utils
+
+
+TABLE_NAME = 'UnitTestData'
+STACK_NAME = 'thiscovery-events'
+NUMBER = 1000
+
+
+def uncached_get_table(ddb):
+    ddb_utils.Dynamodb.clear_table_cache()
+    return ddb.get_table(TABLE_NAME)
+
+
+def main():
+    ddb = ddb_utils.Dynamodb(stack_name=STACK_NAME)
+    ddb.get_table(TABLE_NAME)  # warm up
+    uncached = min(timeit.repeat(lambda: uncached_get_table(ddb), number=NUMBER, repeat=5)) / NUMBER
+    ddb.get_table(TABLE_NAME)
+    cached = min(timeit.repeat(lambda: ddb.get_table(TABLE_NAME), number=NUMBER, repeat=5)) / NUMBER
+    print(f'get_table without cache: {uncached * 1e6:.1f} µs per call')
+    print(f'get_table with cache: {cached * 1e6:.1f} µs per call')
+    print(f'saving: {(uncached - cached) * 1e6:.1f} µs per call')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#
+#   Thiscovery API - THIS Institute’s citizen science platform
+#   Copyright (C) 2021 THIS Institute
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   A copy of the GNU Affero General Public License is available in the
+#   docs folder of this project.  It is also available www.gnu.org/licenses/
+#
+"""
+Measures the cold-start import cost of each thiscovery_lib module using python -X importtime.
+
+Each module is imported in a fresh interpreter; the best of several runs is reported. Run from the repository root:
+    python -m benchmarks.benchmark_import_time
+    python -m benchmarks.benchmark_import_time --save import_times.json
+    python -m benchmarks.benchmark_import_time --baseline import_times.json --tolerance 0.25
+
+With --baseline, the script exits with a non-zero status if any module is slower than its baseline by more than
+the given tolerance (a fraction of the baseline).
+"""
+import argparse
+import json
+import os
+import pkgutil
+import subprocess
+import sys
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+PACKAGE_NAME = 'thiscovery_lib'
+
+
+def list_modules():
+    package_path = os.path.join(REPO_ROOT, PACKAGE_NAME)
+    return sorted(f'{PACKAGE_NAME}.{x.name}' for x in pkgutil.iter_modules([package_path]))
+
+
+def import_time_us(module_name):
+    """
+    Returns the cumulative import time of module_name, in microseconds, measured in a fresh interpreter
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'Failed to import {module_name}: {result.stderr.splitlines()[-1]}')
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == module_name:
+            return int(cumulative)
+    raise RuntimeError(f'Import time of {module_name} not found in -X importtime output')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--repeat', type=int, default=5, help='number of runs per module (best is reported)')
+    arg_parser.add_argument('--save', help='save results to this json file')
+    arg_parser.add_argument('--baseline', help='compare results with those saved in this json file')
+    arg_parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown relative to baseline')
+    args = arg_parser.parse_args()
+
+    results = dict()
+    for module_name in list_modules():
+        results[module_name] = min(import_time_us(module_name) for _ in range(args.repeat))
+        print(f'{module_name:<45} {results[module_name] / 1000:8.1f} ms')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = {
+            k: (baseline[k], v) for k, v in results.items()
+            if (k in baseline) and (v > baseline[k] * (1 + args.tolerance))
+        }
+        for module_name, (before, after) in regressions.items():
+            print(f'REGRESSION {module_name}: {before / 1000:.1f} ms -> {after / 1000:.1f} ms')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#
+#   Thiscovery API - THIS Institute’s citizen science platform
+#   Copyright (C) 2021 THIS Institute
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   A copy of the GNU Affero General Public License is available in the
+#   docs folder of this project.  It is also available www.gnu.org/licenses/
+#
+"""
+Compares the batch validators (validate_uuids, validate_utc_datetimes, validate_ints, validate_booleans) with calling
+the corresponding per-value validators on each element of a column.
+
+Run from the repository root:
+    python -m benchmarks.benchmark_validators [--rows 10000]
+"""
+import argparse
+import timeit
+import uuid
+
+import thiscovery_lib.utilities as utils
+
+
+def per_value(validator, values):
+    for v in values:
+        validator(v)
+
+
+def columns(rows):
+    return {
+        'uuid': (utils.validate_uuid, utils.validate_uuids, [str(uuid.uuid4()) for _ in range(rows)]),
+        'utc_datetime': (utils.validate_utc_datetime, utils.validate_utc_datetimes,
+                         [str(utils.now_with_tz()) for _ in range(rows)]),
+        'int': (utils.validate_int, utils.validate_ints, [str(i) for i in range(rows)]),
+        'boolean': (utils.validate_boolean, utils.validate_booleans, ['true', 'False', '0'] * (rows // 3)),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=10000, help='number of values per column')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='number of measurements; the fastest is reported')
+    args = arg_parser.parse_args()
+
+    print(f"{'column':<14}{'per value (ms)':>16}{'batch (ms)':>12}{'speed-up':>10}")
+    for name, (validator, batch_validator, values) in columns(args.rows).items():
+        assert not batch_validator(values)
+        single = min(timeit.repeat(lambda: per_value(validator, values), number=1, repeat=args.repeat))
+        batch = min(timeit.repeat(lambda: batch_validator(values), number=1, repeat=args.repeat))
+        print(f'{name:<14}{single * 1000:>16.1f}{batch * 1000:>12.1f}{single / batch:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,9 @@ setuptools.setup(
         'requests',
         'validators',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+    },
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/THIS-Institute/thiscovery-lib",
@@ -31,5 +34,5 @@ setuptools.setup(
         "License :: OSI Approved :: GNU Affero General Public License v3",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
\ No newline at end of file
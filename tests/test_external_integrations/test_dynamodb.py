@@ -17,7 +17,11 @@
 #
 import local.dev_config  # sets env variables TEST_ON_AWS and AWS_TEST_API
 import local.secrets  # sets env variables THISCOVERY_AFS25_PROFILE and THISCOVERY_AMP205_PROFILE
+import boto3
+import gc
+import threading
 import thiscovery_dev_tools.testing_tools as test_utils
+from boto3.dynamodb.conditions import Key
 
 import thiscovery_lib.utilities as utils
 from thiscovery_lib import dynamodb_utilities as ddb_utils
@@ -225,6 +229,54 @@ class TestDynamoDbSortKeys(TestDynamoDbBase):
         self.common_assertions_sort_key(item, result, 'modified')
         self.assertEqual(item['country_code'], result['country_code'])
 
+    def test_batch_put_items_mixed_sort_keys_fail(self):
+        items = [
+            {'key': 'test_data_with_sort_key', 'sort_key': {'data_sort': 'test000'}, 'item_details': {'att1': 'val1.0'}},
+            {'key': 'test_data_with_sort_key', 'item_details': {'att1': 'val1.1'}},
+        ]
+        with self.assertRaises(utils.DetailedValueError) as error:
+            self.ddb.batch_put_items(SORTKEY_TEST_TABLE_NAME, items, item_type='test data', update_allowed=True,
+                                     key_name='data_type')
+        self.assertEqual(['data_sort'], error.exception.details['expected_sort_key_names'])
+        self.assertEqual(1, error.exception.details['committed_count'])
+
+    def test_query_returns_all_pages(self):
+        self.put_test_items_with_sort_key(5)
+        items = list(self.ddb.iter_query(
+            table_name=SORTKEY_TEST_TABLE_NAME,
+            page_size=2,
+            KeyConditionExpression=Key('data_type').eq('test_data_with_sort_key'),
+        ))
+        self.assertEqual(5, len(items))
+
+    def test_query_page_cursor(self):
+        self.put_test_items_with_sort_key(5)
+        sort_keys = list()
+        cursor = None
+        page_count = 0
+        while True:
+            items, cursor = self.ddb.query_page(
+                table_name=SORTKEY_TEST_TABLE_NAME,
+                page_size=2,
+                cursor=cursor,
+                KeyConditionExpression=Key('data_type').eq('test_data_with_sort_key'),
+            )
+            page_count += 1
+            sort_keys += [x['data_sort'] for x in items]
+            if cursor is None:
+                break
+        self.assertEqual([f'test{n:03}' for n in range(5)], sort_keys)
+        self.assertLessEqual(3, page_count)
+
+    def test_query_page_invalid_cursor(self):
+        with self.assertRaises(utils.DetailedValueError):
+            self.ddb.query_page(
+                table_name=SORTKEY_TEST_TABLE_NAME,
+                page_size=2,
+                cursor='not a cursor',
+                KeyConditionExpression=Key('data_type').eq('test_data_with_sort_key'),
+            )
+
 
 class TestDynamoDB(TestDynamoDbBase):
 
@@ -258,6 +310,49 @@ class TestDynamoDB(TestDynamoDbBase):
         self.assertEqual('ACTIVE', table.table_status)
         self.assertEqual(0, len(items))
 
+    def test_get_table_cached(self):
+        table = self.ddb.get_table(DEFAULT_TEST_TABLE_NAME)
+        self.assertIs(table, self.ddb.get_table(DEFAULT_TEST_TABLE_NAME))
+        self.assertIs(table, ddb_utils.Dynamodb(stack_name=TEST_TABLE_STACK).get_table(DEFAULT_TEST_TABLE_NAME))
+        ddb_utils.Dynamodb.clear_table_cache(table_name=DEFAULT_TEST_TABLE_NAME)
+        self.assertIsNot(table, self.ddb.get_table(DEFAULT_TEST_TABLE_NAME))
+
+    def test_get_table_not_shared_across_threads(self):
+        table = self.ddb.get_table(DEFAULT_TEST_TABLE_NAME)
+        other_thread_tables = list()
+        thread = threading.Thread(target=lambda: other_thread_tables.append(
+            ddb_utils.Dynamodb(stack_name=TEST_TABLE_STACK).get_table(DEFAULT_TEST_TABLE_NAME)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(table, other_thread_tables[0])
+        self.assertIs(table, self.ddb.get_table(DEFAULT_TEST_TABLE_NAME))
+
+    def test_table_cache_released_with_resource(self):
+        ddb = ddb_utils.Dynamodb(stack_name=TEST_TABLE_STACK)
+        ddb.client = boto3.session.Session().resource('dynamodb')
+        resource_id = id(ddb.client)
+        ddb.get_table(DEFAULT_TEST_TABLE_NAME)
+        self.assertIn(resource_id, ddb_utils.Dynamodb._table_cache)
+        del ddb
+        gc.collect()
+        self.assertNotIn(resource_id, ddb_utils.Dynamodb._table_cache)
+
+    def test_clear_boto3_registry_clears_table_cache(self):
+        table = ddb_utils.Dynamodb(stack_name=TEST_TABLE_STACK).get_table(DEFAULT_TEST_TABLE_NAME)
+        utils.clear_boto3_registry()
+        self.assertIsNot(table, ddb_utils.Dynamodb(stack_name=TEST_TABLE_STACK).get_table(DEFAULT_TEST_TABLE_NAME))
+
+    def test_lease_held_by_one_owner_at_a_time(self):
+        self.assertTrue(self.ddb.acquire_lease(DEFAULT_TEST_TABLE_NAME, 'test-lease', 'owner-1', duration=60))
+        self.assertFalse(self.ddb.acquire_lease(DEFAULT_TEST_TABLE_NAME, 'test-lease', 'owner-2', duration=60))
+        self.assertFalse(self.ddb.release_lease(DEFAULT_TEST_TABLE_NAME, 'test-lease', 'owner-2'))
+        self.assertTrue(self.ddb.release_lease(DEFAULT_TEST_TABLE_NAME, 'test-lease', 'owner-1'))
+        self.assertTrue(self.ddb.acquire_lease(DEFAULT_TEST_TABLE_NAME, 'test-lease', 'owner-2', duration=60))
+
+    def test_expired_lease_can_be_acquired(self):
+        self.assertTrue(self.ddb.acquire_lease(DEFAULT_TEST_TABLE_NAME, 'test-lease', 'owner-1', duration=-1))
+        self.assertTrue(self.ddb.acquire_lease(DEFAULT_TEST_TABLE_NAME, 'test-lease', 'owner-2', duration=60))
+
     def test_put_and_get_ok(self):
         item = TEST_ITEM_01
         self.ddb.put_item(DEFAULT_TEST_TABLE_NAME, item['key'], item['item_type'], item['details'], item, False)
@@ -329,3 +424,103 @@ class TestDynamoDB(TestDynamoDbBase):
         result = self.ddb.get_item(DEFAULT_TEST_TABLE_NAME, item['key'])
         self.common_assertions(item, result, 'modified')
         self.assertEqual(item['country_code'], result['country_code'])
+
+    def test_scan_returns_all_pages(self):
+        self.put_test_items(5)
+        items = list(self.ddb.iter_scan(DEFAULT_TEST_TABLE_NAME, page_size=2))
+        self.assertEqual(5, len(items))
+        self.assertEqual(5, len(self.ddb.scan(DEFAULT_TEST_TABLE_NAME)))
+
+    def test_iter_scan_max_items(self):
+        self.put_test_items(5)
+        items = list(self.ddb.iter_scan(DEFAULT_TEST_TABLE_NAME, page_size=2, max_items=3))
+        self.assertEqual(3, len(items))
+
+    def test_iter_scan_resume_from_checkpoint(self):
+        self.put_test_items(5)
+        checkpoints = list()
+        first_items = list(self.ddb.iter_scan(DEFAULT_TEST_TABLE_NAME, max_items=2, page_callback=checkpoints.append))
+        self.assertEqual(2, len(first_items))
+        self.assertIsNotNone(checkpoints[-1])
+        remaining_items = list(self.ddb.iter_scan(DEFAULT_TEST_TABLE_NAME, exclusive_start_key=checkpoints[-1]))
+        self.assertEqual(3, len(remaining_items))
+        all_ids = {x['id'] for x in first_items + remaining_items}
+        self.assertEqual({f'test{n:03}' for n in range(5)}, all_ids)
+
+    def test_parallel_scan_merged_stream(self):
+        self.put_test_items(10)
+        items = list(self.ddb.parallel_scan(DEFAULT_TEST_TABLE_NAME, total_segments=3, page_size=2))
+        self.assertEqual({f'test{n:03}' for n in range(10)}, {x['id'] for x in items})
+
+    def test_parallel_scan_segment_callback(self):
+        self.put_test_items(10)
+        received_ids = list()
+        progress = dict()
+
+        def record_progress(segment, item_count, finished):
+            progress[segment] = (item_count, finished)
+
+        result = self.ddb.parallel_scan(
+            DEFAULT_TEST_TABLE_NAME,
+            total_segments=3,
+            max_workers=2,
+            segment_callback=lambda segment, items: received_ids.extend(x['id'] for x in items),
+            progress_callback=record_progress,
+        )
+        self.assertEqual({0, 1, 2}, set(result.keys()))
+        self.assertEqual(10, sum(result.values()))
+        self.assertEqual(10, len(received_ids))
+        self.assertTrue(all(finished for _, finished in progress.values()))
+
+    def test_batch_get_items(self):
+        self.put_test_items(5)
+        result = self.ddb.batch_get_items(DEFAULT_TEST_TABLE_NAME, ['test001', 'test003', 'test003', 'non-existent'])
+        self.assertEqual({'test001', 'test003'}, set(result.keys()))
+        self.assertEqual({'att1': 'val1.3', 'att2': 'val2.3'}, result['test003']['details'])
+
+    def test_batch_get_items_projection(self):
+        self.put_test_items(3)
+        result = self.ddb.batch_get_items(DEFAULT_TEST_TABLE_NAME, ['test000', 'test002'], projection=['type'])
+        self.assertEqual({'id': 'test002', 'type': 'test data'}, result['test002'])
+
+    def test_batch_put_items_ok(self):
+        items = [{'key': f'test{n:03}', 'item_details': {'att1': f'val1.{n}'}} for n in range(30)]
+        count = self.ddb.batch_put_items(DEFAULT_TEST_TABLE_NAME, items, item_type='test data', update_allowed=True)
+        self.assertEqual(30, count)
+        result = self.ddb.get_item(DEFAULT_TEST_TABLE_NAME, 'test029')
+        self.assertEqual('test data', result['type'])
+        self.assertEqual({'att1': 'val1.29'}, result['details'])
+        self.assertEqual(result['created'], result['modified'])
+        self.assertEqual(30, len(self.ddb.scan(DEFAULT_TEST_TABLE_NAME)))
+
+    def test_batch_put_items_repeated_keys(self):
+        items = [{'key': f'test{n % 3:03}', 'item_details': {'att1': f'val1.{n}'}} for n in range(6)]
+        count = self.ddb.batch_put_items(DEFAULT_TEST_TABLE_NAME, items, item_type='test data', update_allowed=True)
+        self.assertEqual(6, count)
+        self.assertEqual({'att1': 'val1.5'}, self.ddb.get_item(DEFAULT_TEST_TABLE_NAME, 'test002')['details'])
+        self.assertEqual(3, len(self.ddb.scan(DEFAULT_TEST_TABLE_NAME)))
+
+    def test_batch_put_items_duplicate_fail(self):
+        self.put_test_items(1)
+        items = [{'key': f'test{n:03}', 'item_details': {'att1': f'val1.{n}'}} for n in range(3)]
+        with self.assertRaises(utils.DetailedValueError) as error:
+            self.ddb.batch_put_items(DEFAULT_TEST_TABLE_NAME, items, item_type='test data')
+        self.assertEqual('TransactionCanceledException', error.exception.details['error_code'])
+        self.assertIsNone(self.ddb.get_item(DEFAULT_TEST_TABLE_NAME, 'test002'))
+
+    def test_batch_put_items_duplicate_fail_reports_committed_chunks(self):
+        self.put_test_items(1)
+        items = [{'key': f'test{n:03}', 'item_details': {'att1': f'val1.{n}'}} for n in range(1, 120)]
+        items.append({'key': 'test000', 'item_details': {'att1': 'val1.0'}})
+        with self.assertRaises(utils.DetailedValueError) as error:
+            self.ddb.batch_put_items(DEFAULT_TEST_TABLE_NAME, items, item_type='test data')
+        self.assertEqual(ddb_utils.TRANSACT_WRITE_MAX_ITEMS, error.exception.details['committed_count'])
+        self.assertIsNotNone(self.ddb.get_item(DEFAULT_TEST_TABLE_NAME, 'test100'))
+        self.assertIsNone(self.ddb.get_item(DEFAULT_TEST_TABLE_NAME, 'test101'))
+
+    def test_delete_all_summary(self):
+        self.put_test_items(30)
+        summary = self.ddb.delete_all(DEFAULT_TEST_TABLE_NAME, total_segments=3)
+        self.assertEqual(30, summary['deleted_count'])
+        self.assertIn('elapsed_ms', summary)
+        self.assertEqual(0, len(self.ddb.scan(DEFAULT_TEST_TABLE_NAME)))
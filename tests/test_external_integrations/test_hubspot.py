@@ -17,10 +17,15 @@
 #
 import local.dev_config  # sets env variables TEST_ON_AWS and AWS_TEST_API
 import local.secrets  # sets env variables THISCOVERY_AFS25_PROFILE and THISCOVERY_AMP205_PROFILE
+import json
+import requests
+import threading
+import time
 from http import HTTPStatus
-from unittest import TestCase
+from unittest import TestCase, mock
 import thiscovery_dev_tools.testing_tools as test_utils
 
+import thiscovery_lib.dynamodb_utilities as ddb_utils
 import thiscovery_lib.hubspot_utilities as hs
 from thiscovery_lib.hubspot_utilities import HubSpotClient
 from thiscovery_lib.utilities import set_running_unit_tests, now_with_tz, new_correlation_id
@@ -274,6 +279,378 @@ class TestHubspotClient(TestCase):
     # endregion
 
 
+class TestHubspotTokenCache(TestCase):
+
+    def setUp(self):
+        hs.clear_hubspot_token_cache()
+
+    def tearDown(self):
+        hs.clear_hubspot_token_cache()
+
+    @staticmethod
+    def token_item(expires_in, access_token='cached-access-token'):
+        return {
+            'modified': str(now_with_tz()),
+            'details': {
+                'access_token': access_token,
+                'expires_in': expires_in,
+                'refresh_token': 'cached-refresh-token',
+            },
+        }
+
+    def test_token_shared_by_instances(self):
+        with mock.patch.object(ddb_utils.Dynamodb, 'get_item', return_value=self.token_item(21600)) as mocked_get_item:
+            clients = [HubSpotClient(), HubSpotClient(), hs.SingleSendClient()]
+        self.assertEqual(['cached-access-token'] * 3, [x.access_token for x in clients])
+        self.assertEqual(2, mocked_get_item.call_count)  # once for each token item
+
+    def test_token_refreshed_before_expiry(self):
+        with mock.patch.object(ddb_utils.Dynamodb, 'get_item', return_value=self.token_item(60)):
+            hs_client = HubSpotClient()
+            with mock.patch.object(HubSpotClient, 'refresh_access_token') as mocked_refresh:
+                hs_client.ensure_valid_token()
+        mocked_refresh.assert_called_once()
+
+    def test_valid_token_not_refreshed(self):
+        with mock.patch.object(ddb_utils.Dynamodb, 'get_item', return_value=self.token_item(21600)):
+            hs_client = HubSpotClient()
+            with mock.patch.object(HubSpotClient, 'refresh_access_token') as mocked_refresh:
+                hs_client.ensure_valid_token()
+        mocked_refresh.assert_not_called()
+
+
+class FakeTokensTable:
+    """
+    Thread-safe in-memory stand-in for the parts of Dynamodb used by HubSpotClient token management
+    """
+    def __init__(self, token_item):
+        self.items = {'hubspot': token_item}
+        self.lock = threading.Lock()
+
+    def get_item(self, table_name, key, correlation_id=None):
+        with self.lock:
+            return self.items.get(key)
+
+    def put_item(self, table_name, key, item_type, item_details, item=dict(), update_allowed=False, correlation_id=None):
+        with self.lock:
+            self.items[key] = {'details': item_details, 'modified': str(now_with_tz())}
+
+    def acquire_lease(self, table_name, key, owner, duration, correlation_id=None):
+        with self.lock:
+            lease = self.items.get(key)
+            if lease is not None and lease['lease_expires_at'] > time.time():
+                return False
+            self.items[key] = {'lease_owner': owner, 'lease_expires_at': time.time() + duration}
+            return True
+
+    def release_lease(self, table_name, key, owner, correlation_id=None):
+        with self.lock:
+            if self.items.get(key, dict()).get('lease_owner') == owner:
+                del self.items[key]
+                return True
+            return False
+
+
+class TestHubspotTokenRefreshLease(TestCase):
+    number_of_workers = 20
+
+    def setUp(self):
+        hs.clear_hubspot_token_cache()
+
+    def tearDown(self):
+        hs.clear_hubspot_token_cache()
+
+    def run_concurrent_refreshers(self, fake_table, oauth_delay):
+        """
+        Returns:
+            Tuple (OAuth requests made, clients that refreshed their token, errors raised by clients)
+        """
+        oauth_calls = list()
+        errors = list()
+
+        def fake_oauth_request(method, url, data, timeout):
+            oauth_calls.append(data)
+            time.sleep(oauth_delay)  # give other workers time to pile up
+            response = mock.Mock(status_code=HTTPStatus.OK)
+            response.json.return_value = {
+                'access_token': 'new-access-token', 'expires_in': 21600, 'refresh_token': 'cached-refresh-token'
+            }
+            return response
+
+        def refresh(client):
+            try:
+                client.refresh_access_token()
+            except Exception as ex:
+                errors.append(ex)
+
+        with mock.patch.object(ddb_utils, 'Dynamodb', return_value=fake_table), \
+                mock.patch.object(hs, 'get_secret', return_value={'app-id': 1, 'client-id': 'id', 'client-secret': 's'}), \
+                mock.patch.object(hs.utils, 'get_http_session', return_value=mock.Mock(request=fake_oauth_request)), \
+                mock.patch.object(hs, 'HUBSPOT_TOKEN_LEASE_POLL_INTERVAL', 0.05):
+            # each worker stands in for a Lambda: its own client and no shared in-process token
+            clients = list()
+            for _ in range(self.number_of_workers):
+                hs.clear_hubspot_token_cache()
+                clients.append(HubSpotClient())
+            threads = [threading.Thread(target=refresh, args=(x,)) for x in clients]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        return oauth_calls, clients, errors
+
+    def test_concurrent_refreshers_call_hubspot_once(self):
+        fake_table = FakeTokensTable(TestHubspotTokenCache.token_item(expires_in=60, access_token='old-access-token'))
+        oauth_calls, clients, errors = self.run_concurrent_refreshers(fake_table, oauth_delay=0.5)
+        self.assertEqual([], errors)
+        self.assertEqual(1, len(oauth_calls))
+        self.assertEqual(['new-access-token'] * self.number_of_workers, [x.access_token for x in clients])
+        self.assertEqual('new-access-token', fake_table.items['hubspot']['details']['access_token'])
+
+    def test_waiters_outlast_slow_lease_holder(self):
+        fake_table = FakeTokensTable(TestHubspotTokenCache.token_item(expires_in=60, access_token='old-access-token'))
+        with mock.patch.object(hs, 'HUBSPOT_TOKEN_LEASE_DURATION', 2), \
+                mock.patch.object(hs, 'HUBSPOT_TOKEN_LEASE_WAIT', 0.2):
+            oauth_calls, clients, errors = self.run_concurrent_refreshers(fake_table, oauth_delay=1)
+        self.assertEqual([], errors)
+        self.assertEqual(1, len(oauth_calls))
+        self.assertEqual(['new-access-token'] * self.number_of_workers, [x.access_token for x in clients])
+
+    def test_lease_outlasts_token_request(self):
+        self.assertGreater(hs.HUBSPOT_TOKEN_LEASE_DURATION, hs.HUBSPOT_RETRY_DEADLINE + sum(hs.HUBSPOT_TIMEOUT))
+        self.assertGreaterEqual(hs.HUBSPOT_TOKEN_LEASE_WAIT, hs.HUBSPOT_TOKEN_LEASE_DURATION)
+
+    def test_lease_errors_do_not_bypass_lease(self):
+        fake_table = FakeTokensTable(TestHubspotTokenCache.token_item(expires_in=60, access_token='old-access-token'))
+        acquire_lease = fake_table.acquire_lease
+        failed_owners = set()
+
+        def flaky_acquire_lease(table_name, key, owner, duration, correlation_id=None):
+            if owner not in failed_owners:
+                failed_owners.add(owner)
+                raise hs.DetailedValueError('Dynamodb raised an error', {'error_code': 'ProvisionedThroughputExceededException'})
+            return acquire_lease(table_name, key, owner, duration, correlation_id=correlation_id)
+
+        fake_table.acquire_lease = flaky_acquire_lease
+        oauth_calls, clients, errors = self.run_concurrent_refreshers(fake_table, oauth_delay=0.5)
+        self.assertEqual([], errors)
+        self.assertEqual(1, len(oauth_calls))
+        self.assertEqual(['new-access-token'] * self.number_of_workers, [x.access_token for x in clients])
+
+
+class TestHubspotRetries(TestCase):
+
+    def setUp(self):
+        hs.clear_hubspot_token_cache()
+        with mock.patch.object(ddb_utils.Dynamodb, 'get_item', return_value=TestHubspotTokenCache.token_item(21600)):
+            self.hs_client = HubSpotClient()
+
+    @staticmethod
+    def response(status_code, headers=None, body='{}'):
+        response = mock.Mock(status_code=status_code, headers=headers or dict(), text=body, content=body.encode())
+        response.json.return_value = json.loads(body)
+        return response
+
+    def request_with_responses(self, method, responses):
+        session = mock.Mock()
+        session.request.side_effect = responses
+        with mock.patch.object(hs.utils, 'get_http_session', return_value=session), \
+                mock.patch.object(hs, 'HUBSPOT_RETRY_BASE_DELAY', 0), \
+                mock.patch.object(hs, 'HUBSPOT_MAX_RETRIES', 2):
+            try:
+                return self.hs_client.hubspot_token_request(method, '/contacts/v1/spam')
+            finally:
+                self.request_count = session.request.call_count
+
+    def test_throttled_request_retried_after_retry_after(self):
+        responses = [self.response(HTTPStatus.TOO_MANY_REQUESTS, headers={'Retry-After': '0'}),
+                     self.response(HTTPStatus.OK, body='{"vid": 1}')]
+        self.assertEqual({'vid': 1}, self.request_with_responses('GET', responses))
+        self.assertEqual(2, self.request_count)
+
+    def test_get_error_raised_after_retries(self):
+        with self.assertRaises(hs.DetailedValueError):
+            self.request_with_responses('GET', [self.response(HTTPStatus.SERVICE_UNAVAILABLE)] * 3)
+        self.assertEqual(3, self.request_count)
+
+    def test_post_read_timeout_not_retried(self):
+        with self.assertRaises(hs.requests.ReadTimeout):
+            self.request_with_responses('POST', [hs.requests.ReadTimeout()])
+        self.assertEqual(1, self.request_count)
+
+    def test_post_server_error_not_retried(self):
+        with self.assertRaises(hs.DetailedValueError):
+            self.request_with_responses('POST', [self.response(HTTPStatus.SERVICE_UNAVAILABLE),
+                                                 self.response(HTTPStatus.OK)])
+        self.assertEqual(1, self.request_count)
+
+    def test_throttled_post_retried(self):
+        responses = [self.response(HTTPStatus.TOO_MANY_REQUESTS, headers={'Retry-After': '0'}),
+                     self.response(HTTPStatus.OK, body='{"vid": 1}')]
+        self.assertEqual(HTTPStatus.OK, self.request_with_responses('POST', responses).status_code)
+        self.assertEqual(2, self.request_count)
+
+    def test_retry_after_http_date(self):
+        response = self.response(HTTPStatus.TOO_MANY_REQUESTS, headers={'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        self.assertEqual(0, hs.retry_after_seconds(response))
+
+
+class TestHubspotRateLimiter(TestCase):
+
+    def test_fail_fast_when_budget_exhausted(self):
+        bucket = hs.TokenBucket('test', rate=1, capacity=2)
+        bucket.acquire('fail_fast')
+        bucket.acquire('fail_fast')
+        with self.assertRaises(hs.HubSpotRateLimitError):
+            bucket.acquire('fail_fast')
+
+    def test_queued_requests_spaced_by_rate(self):
+        bucket = hs.TokenBucket('test', rate=100, capacity=1)
+        delays = [bucket.reserve() for _ in range(3)]
+        self.assertEqual(0, delays[0])
+        self.assertAlmostEqual(0.01, delays[1], places=3)
+        self.assertAlmostEqual(0.02, delays[2], places=3)
+
+    def test_block_waits_for_budget(self):
+        bucket = hs.TokenBucket('test', rate=20, capacity=1)
+        start = time.monotonic()
+        for _ in range(3):
+            bucket.acquire('block', max_wait=1)
+        self.assertGreater(time.monotonic() - start, 0.05)
+
+    def test_budget_adapts_to_response_headers(self):
+        bucket = hs.TokenBucket('test', rate=100, capacity=100)
+        bucket.update_from_headers({
+            'X-HubSpot-RateLimit-Max': '100',
+            'X-HubSpot-RateLimit-Interval-Milliseconds': '10000',
+            'X-HubSpot-RateLimit-Remaining': '0',
+            'X-HubSpot-RateLimit-Daily-Remaining': '1000',
+        })
+        self.assertEqual(10, bucket.rate)
+        self.assertFalse(bucket.try_acquire())
+        bucket.update_from_headers({'X-HubSpot-RateLimit-Daily-Remaining': '0'})
+        with self.assertRaises(hs.HubSpotRateLimitError):
+            bucket.acquire('queue')
+
+    def test_no_token_before_exhausted_interval_ends(self):
+        clock = [1000.0]
+        with mock.patch.object(hs.time, 'monotonic', side_effect=lambda: clock[0]):
+            bucket = hs.TokenBucket('test', rate=100, capacity=100)
+            bucket.update_from_headers({
+                'X-HubSpot-RateLimit-Max': '100',
+                'X-HubSpot-RateLimit-Interval-Milliseconds': '10000',
+                'X-HubSpot-RateLimit-Remaining': '0',
+            })
+            for _ in range(99):
+                clock[0] += 0.1
+                self.assertFalse(bucket.try_acquire())
+            self.assertAlmostEqual(0.1 + 0.1, bucket.reserve(), places=6)  # rest of the interval, then one refill
+            clock[0] += 1
+            self.assertTrue(bucket.try_acquire())
+
+    def test_rate_recovers_from_response_headers(self):
+        bucket = hs.TokenBucket('test', rate=100, capacity=100)
+        bucket.update_from_headers({
+            'X-HubSpot-RateLimit-Max': '10',
+            'X-HubSpot-RateLimit-Interval-Milliseconds': '10000',
+        })
+        self.assertEqual(1, bucket.rate)
+        bucket.update_from_headers({
+            'X-HubSpot-RateLimit-Max': '200',
+            'X-HubSpot-RateLimit-Interval-Milliseconds': '10000',
+        })
+        self.assertEqual(20, bucket.rate)
+        bucket.update_from_headers({
+            'X-HubSpot-RateLimit-Max': '10000',
+            'X-HubSpot-RateLimit-Interval-Milliseconds': '10000',
+        })
+        self.assertEqual(100, bucket.rate)  # never above the configured rate
+
+    def test_daily_limit_probed_after_interval(self):
+        bucket = hs.TokenBucket('test', rate=100, capacity=100)
+        with mock.patch.object(hs, 'HUBSPOT_DAILY_LIMIT_PROBE_INTERVAL', 0.05):
+            bucket.update_from_headers({'X-HubSpot-RateLimit-Daily-Remaining': '0'})
+            with self.assertRaises(hs.HubSpotRateLimitError):
+                bucket.acquire('fail_fast')
+            time.sleep(0.06)
+            bucket.acquire('fail_fast')  # probe request
+            with self.assertRaises(hs.HubSpotRateLimitError):
+                bucket.acquire('fail_fast')  # only one probe per interval
+            bucket.update_from_headers({'X-HubSpot-RateLimit-Daily-Remaining': '250000'})
+            bucket.acquire('fail_fast')
+
+    def test_limiter_shared_per_app(self):
+        self.assertIs(hs.get_rate_limiter('main'), hs.get_rate_limiter('main'))
+        self.assertIsNot(hs.get_rate_limiter('main'), hs.get_rate_limiter('emails'))
+
+
+class TestHubspotBatchContacts(TestCase):
+
+    def setUp(self):
+        hs.clear_hubspot_token_cache()
+        with mock.patch.object(ddb_utils.Dynamodb, 'get_item', return_value=TestHubspotTokenCache.token_item(21600)):
+            self.hs_client = HubSpotClient()
+
+    @staticmethod
+    def batch_response(data):
+        """
+        Echoes inputs as created contacts, except for those whose email starts with 'invalid' (rejected) or 'missing'
+        (omitted from the response)
+        """
+        results, errors = list(), list()
+        for n, x in enumerate(data['inputs']):
+            if x['id'].startswith('missing'):
+                continue
+            if x['id'].startswith('invalid'):
+                errors.append({'status': 'error', 'message': 'Invalid email', 'context': {'ids': [x['id']]}})
+            else:
+                results.append({'id': str(n), 'properties': {'email': x['id'].lower()}, 'new': True})
+        body = json.dumps({'status': 'COMPLETE', 'results': results, 'errors': errors})
+        return mock.Mock(status_code=HTTPStatus.MULTI_STATUS if errors else HTTPStatus.OK, content=body.encode(),
+                         json=lambda: json.loads(body))
+
+    def test_post_new_users_to_crm_in_chunks(self):
+        new_users = [{**TEST_USER_01, 'email': f'User{n}@email.co.uk'} for n in range(250)]
+        new_users.append({**TEST_USER_01, 'email': 'invalid-email'})
+        with mock.patch.object(HubSpotClient, 'post', side_effect=lambda url, data: self.batch_response(data)) as mocked_post:
+            results = self.hs_client.post_new_users_to_crm(new_users)
+        self.assertEqual(3, mocked_post.call_count)
+        self.assertEqual('/crm/v3/objects/contacts/batch/upsert', mocked_post.call_args[0][0])
+        self.assertEqual({'vid': 0, 'isNew': True, 'error': None}, results['User0@email.co.uk'])
+        self.assertEqual('Invalid email', results['invalid-email']['error'])
+        self.assertEqual(251, len(results))
+
+    def test_update_contacts_by_email_rejected_chunk(self):
+        changes = {'sw@email.co.uk': [{'property': 'thiscovery_last_login_date', 'value': 1}]}
+        rejection = hs.DetailedValueError('Hubspot call returned HTTP code 400', dict())
+        with mock.patch.object(HubSpotClient, 'post', side_effect=rejection):
+            results = self.hs_client.update_contacts_by_email(changes)
+        self.assertEqual('Hubspot call returned HTTP code 400', results['sw@email.co.uk']['error'])
+
+    def test_contact_missing_from_response_has_error(self):
+        new_users = [{**TEST_USER_01, 'email': x} for x in ['user@email.co.uk', 'missing@email.co.uk']]
+        with mock.patch.object(HubSpotClient, 'post', side_effect=lambda url, data: self.batch_response(data)):
+            results = self.hs_client.post_new_users_to_crm(new_users)
+        self.assertIsNone(results['user@email.co.uk']['error'])
+        self.assertEqual({'vid': None, 'isNew': False, 'error': 'no result returned'}, results['missing@email.co.uk'])
+
+    def test_failed_chunk_keeps_results_of_earlier_chunks(self):
+        new_users = [{**TEST_USER_01, 'email': f'user{n}@email.co.uk'} for n in range(150)]
+        responses = [self.batch_response, requests.ConnectionError('Connection reset by peer')]
+
+        def post(url, data):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response(data)
+
+        with mock.patch.object(HubSpotClient, 'post', side_effect=post):
+            results = self.hs_client.post_new_users_to_crm(new_users)
+        self.assertEqual({'vid': 0, 'isNew': True, 'error': None}, results['user0@email.co.uk'])
+        self.assertIn('Connection reset by peer', results['user149@email.co.uk']['error'])
+        self.assertIsNone(results['user149@email.co.uk']['vid'])
+
+
 class TestSingleSendClient(test_utils.BaseTestCase):
     test_custom_properties = [
         {
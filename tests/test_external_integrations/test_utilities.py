@@ -17,8 +17,15 @@
 #
 import local.dev_config  # sets env variables TEST_ON_AWS and AWS_TEST_API
 import local.secrets  # sets env variables THISCOVERY_AFS25_PROFILE and THISCOVERY_AMP205_PROFILE
+import email.message
+import gc
+import json
+import logging
+import threading
+import urllib.request
+import weakref
 import thiscovery_lib.utilities as utils
-from unittest import TestCase
+from unittest import TestCase, mock
 
 import thiscovery_dev_tools.testing_tools as test_utils
 
@@ -34,6 +41,326 @@ class TestOther(test_utils.BaseTestCase):
         self.assertEqual(expected_result, result)
 
 
+class TestBoto3Registry(test_utils.BaseTestCase):
+    def test_clients_are_reused(self):
+        ssm_client_1 = utils.SsmClient()
+        ssm_client_2 = utils.SsmClient()
+        self.assertIs(ssm_client_1.client, ssm_client_2.client)
+        self.assertIsNot(ssm_client_1.client, utils.SecretsManager().client)
+
+    def test_clear_boto3_registry(self):
+        client = utils.SsmClient().client
+        utils.clear_boto3_registry()
+        self.assertIsNot(client, utils.SsmClient().client)
+
+    def test_resources_discarded_with_their_thread(self):
+        resource = utils.get_boto3_client('dynamodb', client_type='resource')
+        other_thread_resources = list()
+        thread = threading.Thread(target=lambda: other_thread_resources.append(
+            weakref.ref(utils.get_boto3_client('dynamodb', client_type='resource'))))
+        thread.start()
+        thread.join()
+        gc.collect()
+        self.assertIsNone(other_thread_resources[0]())
+        self.assertIs(resource, utils.get_boto3_client('dynamodb', client_type='resource'))
+
+    def test_clear_boto3_registry_discards_resources(self):
+        resource = utils.get_boto3_client('dynamodb', client_type='resource')
+        utils.clear_boto3_registry()
+        self.assertIsNot(resource, utils.get_boto3_client('dynamodb', client_type='resource'))
+
+
+class TestTtlCache(TestCase):
+    def test_least_recently_used_entry_evicted(self):
+        cache = utils.TtlCache(ttl=60, max_size=2)
+        cache.set('spam', 1)
+        cache.set('eggs', 2)
+        cache.get('spam')
+        cache.set('ham', 3)
+        self.assertEqual(1, cache.get('spam'))
+        self.assertIsNone(cache.get('eggs'))
+        self.assertEqual(3, cache.get('ham'))
+
+    def test_expired_entry_reloaded(self):
+        cache = utils.TtlCache(ttl=0)
+        self.assertEqual(1, cache.get_or_load('spam', lambda: 1))
+        self.assertEqual(2, cache.get_or_load('spam', lambda: 2))
+
+
+class TestSsmCache(test_utils.BaseTestCase):
+
+    def setUp(self):
+        utils.invalidate_ssm_cache()
+        self.ssm_client = utils.SsmClient()
+
+    def test_get_parameters_batches_and_caches(self):
+        from botocore.stub import Stubber
+        prefix = '/unit-test/'
+        names = [f'parameter-{i}' for i in range(12)]
+        with Stubber(self.ssm_client.client) as stubber:
+            stubber.add_response('get_parameters', {
+                'Parameters': [{'Name': f'{prefix}{x}', 'Value': x} for x in names[:10]]
+            })
+            stubber.add_response('get_parameters', {
+                'Parameters': [{'Name': f'{prefix}{names[10]}', 'Value': names[10]}],
+                'InvalidParameters': [f'{prefix}{names[11]}'],
+            })
+            result = self.ssm_client.get_parameters(names, prefix=prefix)
+            self.assertEqual({x: x for x in names[:11]}, result)
+            # served from cache; any call to AWS would fail as no responses are left
+            self.assertEqual(names[3], self.ssm_client.get_parameter(names[3], prefix=prefix))
+            stubber.assert_no_pending_responses()
+
+    def test_get_parameters_by_path_populates_cache(self):
+        from botocore.stub import Stubber
+        with Stubber(self.ssm_client.client) as stubber:
+            stubber.add_response('get_parameters_by_path', {
+                'Parameters': [{'Name': '/unit-test/spam', 'Value': 'eggs'}],
+                'NextToken': 'next-page',
+            })
+            stubber.add_response('get_parameters_by_path', {
+                'Parameters': [{'Name': '/unit-test/ham', 'Value': 'bacon'}],
+            })
+            result = self.ssm_client.get_parameters_by_path('/unit-test/')
+            self.assertEqual({'/unit-test/spam': 'eggs', '/unit-test/ham': 'bacon'}, result)
+            self.assertEqual(result, self.ssm_client.get_parameters_by_path('/unit-test/'))
+            self.assertEqual('bacon', self.ssm_client.get_parameter('ham', prefix='/unit-test/'))
+            stubber.assert_no_pending_responses()
+
+    def test_get_parameters_background_refresh_keeps_names(self):
+        import time
+        prefix = '/unit-test/'
+        names = ['spam', 'eggs']
+        for name in names:
+            utils._ssm_cache.set(f'{prefix}{name}', f'old-{name}', ttl=1)
+        time.sleep(0.6)  # entries are now within their refresh window
+        loop_finished = threading.Event()
+        refresh = utils._ssm_cache._refresh
+
+        def delayed_refresh(*args):
+            loop_finished.wait(5)  # refresh only after get_parameters has moved on to the next name
+            refresh(*args)
+
+        with mock.patch.object(utils.SsmClient, '_fetch_parameter', autospec=True,
+                               side_effect=lambda self, parameter_name: f'new-{parameter_name}'), \
+                mock.patch.object(utils._ssm_cache, '_refresh', side_effect=delayed_refresh):
+            result = self.ssm_client.get_parameters(names, prefix=prefix)
+            loop_finished.set()
+            for _ in range(50):
+                if not utils._ssm_cache._refreshing:
+                    break
+                time.sleep(0.1)
+        self.assertEqual({'spam': 'old-spam', 'eggs': 'old-eggs'}, result)
+        for name in names:
+            self.assertEqual(f'new-{prefix}{name}', utils._ssm_cache.get(f'{prefix}{name}'))
+
+
+class TestSecretsCache(test_utils.BaseTestCase):
+
+    def setUp(self):
+        utils.invalidate_secret()
+
+    def get_secret_with_call_count(self, secret_name, calls=2):
+        with mock.patch.object(utils.SecretsManager, 'get_secret_value', autospec=True,
+                               side_effect=utils.SecretsManager.get_secret_value) as mocked_get_secret_value:
+            results = [utils.get_secret(secret_name) for _ in range(calls)]
+        return results, mocked_get_secret_value.call_count
+
+    def test_get_secret_cached(self):
+        (first, second), call_count = self.get_secret_with_call_count('runtime-parameters')
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+        self.assertEqual(1, call_count)
+
+    def test_get_secret_not_found_cached(self):
+        results, call_count = self.get_secret_with_call_count('non-existent-secret')
+        self.assertEqual([None, None], results)
+        self.assertEqual(1, call_count)
+
+    def test_invalidate_secret(self):
+        utils.get_secret('runtime-parameters')
+        utils.invalidate_secret('runtime-parameters')
+        _, call_count = self.get_secret_with_call_count('runtime-parameters', calls=1)
+        self.assertEqual(1, call_count)
+
+
+class TestPreloadSecrets(test_utils.BaseTestCase):
+
+    def setUp(self):
+        utils.invalidate_secret()
+
+    def test_preload_secrets_single_batch_call(self):
+        from botocore.stub import Stubber
+        namespace = utils.get_aws_namespace()
+        with Stubber(utils.SecretsManager().client) as stubber:
+            stubber.add_response('batch_get_secret_value', {
+                'SecretValues': [{'Name': f'{namespace}spam-connection', 'SecretString': '{"api-key": "eggs"}'}],
+                'Errors': [{'SecretId': f'{namespace}non-existent-secret', 'ErrorCode': 'ResourceNotFoundException'}],
+            })
+            result = utils.preload_secrets(['spam-connection', 'non-existent-secret'])
+            self.assertEqual({'spam-connection': True, 'non-existent-secret': False}, result)
+            # served from cache; any call to AWS would fail as no responses are left
+            self.assertEqual({'api-key': 'eggs'}, utils.get_secret('spam-connection'))
+            self.assertIsNone(utils.get_secret('non-existent-secret'))
+            stubber.assert_no_pending_responses()
+
+
+class TestHttpSession(TestCase):
+    def test_http_session_is_shared(self):
+        session = utils.get_http_session()
+        self.assertIs(session, utils.get_http_session())
+
+    def test_configure_http_session(self):
+        session = utils.configure_http_session(pool_maxsize=25)
+        self.assertIs(session, utils.get_http_session())
+        self.assertEqual(25, session.get_adapter('https://api.thiscovery.org/')._pool_maxsize)
+
+    def test_configure_http_session_leaves_old_session_open(self):
+        old_session = utils.get_http_session()
+        with mock.patch.object(old_session, 'close') as mock_close:
+            utils.configure_http_session()
+        mock_close.assert_not_called()
+
+    def test_http_session_does_not_keep_cookies(self):
+        session = utils.get_http_session()
+        headers = email.message.Message()
+        headers['Set-Cookie'] = 'session=spam; Path=/'
+        request = urllib.request.Request('https://api.hubapi.com/crm/v3/objects/contacts')
+        session.cookies.extract_cookies(mock.Mock(info=lambda: headers), request)
+        self.assertEqual(0, len(session.cookies))
+
+
+class TestGetLogger(TestCase):
+
+    def setUp(self):
+        self.original_logger = utils.logger
+        self.original_handlers = logging.getLogger('thiscovery').handlers
+        utils.logger = None
+        logging.getLogger('thiscovery').handlers = list()
+
+    def tearDown(self):
+        utils.logger = self.original_logger
+        logging.getLogger('thiscovery').handlers = self.original_handlers
+
+    def test_logger_construction_does_not_fetch_secrets(self):
+        with mock.patch.object(utils, 'get_secret') as mocked_get_secret:
+            utils.get_logger()
+        mocked_get_secret.assert_not_called()
+
+    def test_epsagon_handler_resolves_runtime_parameters_once(self):
+        handler = utils.EpsagonHandler()
+        record = logging.LogRecord('thiscovery', logging.ERROR, __file__, 0, 'error message', None, None)
+        with mock.patch.dict('os.environ', {'THISCOVERY_RUNNING_TESTS': 'true'}):
+            with mock.patch.object(utils, 'get_secret') as mocked_get_secret:
+                handler.emit(record)
+                handler.emit(record)
+        mocked_get_secret.assert_not_called()
+        self.assertEqual('true', handler.running_tests)
+
+    def test_async_logging_writes_records_on_listener_thread(self):
+        written_on = list()
+        with mock.patch.object(utils, 'ASYNC_LOGGING', True):
+            logger = utils.get_logger()
+        try:
+            colour_handler = utils._log_listener.handlers[0]
+            with mock.patch.object(colour_handler, 'emit', side_effect=lambda r: written_on.append(
+                    threading.current_thread())):
+                logger.debug('queued message')
+                utils.flush_logs()
+            self.assertEqual(1, len(written_on))
+            self.assertIsNot(threading.current_thread(), written_on[0])
+        finally:
+            utils.stop_log_listener()
+
+
+class TestLambdaWrapperResultLogging(TestCase):
+
+    @staticmethod
+    def handler(event, context):
+        return list(range(1000))
+
+    def logged_result(self, decorated_handler, event=None):
+        with mock.patch.object(utils.get_logger(), 'info') as mocked_info:
+            decorated_handler(event or dict(), None)
+        if mocked_info.called:
+            return mocked_info.call_args[1]['extra']['result']
+
+    def test_truncate_for_log_max_items(self):
+        result = utils.truncate_for_log({'a': list(range(10)), 'b': 'eggs'}, max_bytes=0, max_items=3)
+        self.assertEqual({'a': [0, 1, 2, '... 7 more items'], 'b': 'eggs'}, result)
+
+    def test_truncate_for_log_max_bytes(self):
+        result = utils.truncate_for_log({'a': 'x' * 1000, 'b': list(range(1000))}, max_bytes=50, max_items=0)
+        self.assertTrue(result['a'].endswith('characters truncated]'))
+        self.assertLess(len(json.dumps(result)), 100)
+
+    def test_truncate_for_log_max_bytes_list(self):
+        result = utils.truncate_for_log(list(range(1000)), max_bytes=100, max_items=0)
+        self.assertTrue(result[-1].endswith('more items'))
+        self.assertLess(len(json.dumps(result)), 150)
+
+    def test_result_truncated(self):
+        result = self.logged_result(utils.lambda_wrapper(max_items=10)(self.handler))
+        self.assertEqual(11, len(result))
+
+    def test_unsampled_result_not_serialised(self):
+        with mock.patch.object(utils, 'truncate_for_log') as mocked_truncate:
+            result = self.logged_result(utils.lambda_wrapper(sample_rate=0)(self.handler))
+        self.assertIsNone(result)
+        mocked_truncate.assert_not_called()
+
+    def test_full_logging_for_correlation_id(self):
+        event = {'headers': {'Correlation_Id': 'full-logging-id'}}
+        with mock.patch.object(utils, 'RESULT_LOG_FULL_CORRELATION_IDS', {'full-logging-id'}):
+            result = self.logged_result(utils.lambda_wrapper(sample_rate=0, max_items=10)(self.handler), event)
+        self.assertEqual(1000, len(result))
+
+
+class TestInvocationMetrics(TestCase):
+
+    @staticmethod
+    def handler_calling_dependencies():
+        from botocore.stub import Stubber
+        client = utils.get_boto3_client('dynamodb')
+
+        @utils.lambda_wrapper
+        def handler(event, context):
+            with Stubber(client) as stubber:
+                stubber.add_response('list_tables', {'TableNames': []})
+                client.list_tables()
+            with utils.time_dependency_call('hubspot'):
+                pass
+            return dict()
+        return handler
+
+    def tearDown(self):
+        utils.clear_boto3_registry()  # discard clients instrumented by tests
+
+    def test_metrics_disabled_by_default(self):
+        self.assertFalse(utils.INVOCATION_METRICS)
+        handler = self.handler_calling_dependencies()
+        with mock.patch('builtins.print') as mocked_print:
+            handler(dict(), None)
+        mocked_print.assert_not_called()
+
+    def test_dependency_calls_recorded_in_emf_record(self):
+        with mock.patch.object(utils, 'INVOCATION_METRICS', True), mock.patch('builtins.print') as mocked_print:
+            utils.clear_boto3_registry()
+            self.handler_calling_dependencies()(dict(), None)
+        emf_record = json.loads(mocked_print.call_args[0][0])
+        self.assertEqual(1, emf_record['dynamodb.calls'])
+        self.assertEqual(0, emf_record['dynamodb.errors'])
+        self.assertEqual(1, emf_record['hubspot.calls'])
+        metric_names = [x['Name'] for x in emf_record['_aws']['CloudWatchMetrics'][0]['Metrics']]
+        self.assertIn('duration_ms', metric_names)
+        self.assertIn('dynamodb.latency_ms', metric_names)
+
+    def test_calls_outside_invocations_not_recorded(self):
+        with utils.time_dependency_call('hubspot'):
+            pass
+        self.assertIsNone(utils._invocation_metrics)
+
+
 class TestCreateAnonymousUrlParams(test_utils.BaseTestCase):
     def test_correct_output_external_task_id_none(self):
         expected_result = '?anon_project_specific_user_id=a0c2668e-60ae-45fc-95e6-50270c0fb6a8' \
@@ -152,6 +479,30 @@ class TestValidateUtcDatetime(TestCase):
         self.assertRaises(DetailedValueError, validate_utc_datetime, dt)
 
 
+class TestBatchValidators(TestCase):
+    def test_validate_uuids(self):
+        import uuid
+        values = [str(uuid.uuid4()), str(uuid.uuid1()), '{%s}' % uuid.uuid4(), 'this is not a uuid', None]
+        errors = utils.validate_uuids(values)
+        self.assertEqual([1, 3, 4], sorted(errors))
+        self.assertEqual('invalid uuid', errors[3].message)
+
+    def test_validate_utc_datetimes(self):
+        values = [str(utils.now_with_tz()), '2018-06-12T16:16:56Z', '2018-02-30 13:40:13', '2018-06-12', '13:40:13.242219']
+        self.assertEqual([2, 4], sorted(utils.validate_utc_datetimes(values)))
+
+    def test_validate_ints(self):
+        self.assertEqual([2, 3], sorted(utils.validate_ints([7, '-7', 'abc', None])))
+
+    def test_validate_booleans(self):
+        self.assertEqual([2, 3], sorted(utils.validate_booleans(['true', '0', 'yes', dict()])))
+
+    def test_batch_validator_raises_all_errors(self):
+        with self.assertRaises(utils.DetailedValueError) as context:
+            utils.validate_ints(['1', 'a', 'b'], raise_errors=True)
+        self.assertEqual([1, 2], sorted(context.exception.details['errors']))
+
+
 class TestMinimiseWhiteSpace(TestCase):
     def test_minimise_white_space_change(self):
         from thiscovery_lib.utilities import minimise_white_space
@@ -17,10 +17,15 @@
 #
 import local.dev_config  # sets env variables TEST_ON_AWS and AWS_TEST_API
 import local.secrets  # sets env variables THISCOVERY_AFS25_PROFILE and THISCOVERY_AMP205_PROFILE
+import asyncio
+import json
 from http import HTTPStatus
 from pprint import pprint
+from unittest import mock
 import thiscovery_dev_tools.testing_tools as test_utils
-from thiscovery_lib.core_api_utilities import CoreApiClient
+import thiscovery_lib.utilities as utils
+import thiscovery_lib.core_api_utilities as core_api_utilities
+from thiscovery_lib.core_api_utilities import AsyncCoreApiClient, CoreApiClient, invalidate_core_api_cache
 
 
 class TestCoreApiUtilities(test_utils.BaseTestCase):
@@ -49,3 +54,116 @@ class TestCoreApiUtilities(test_utils.BaseTestCase):
             anon_user_task_id='3dce6e9c-9b20-4d7f-a266-9967553dbc16'
         )
         self.assertEqual('273b420e-09cb-419c-8b57-b393595dba78', result['project_task_id'])
+
+
+class TestCoreApiClientCache(test_utils.BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.core_client = CoreApiClient(
+            env_override=local.dev_config.UNIT_TEST_NAMESPACE[1:-1],
+            cache=True,
+        )
+
+    def setUp(self):
+        invalidate_core_api_cache()
+
+    def test_get_project_from_project_task_id_cached(self):
+        project_task_id = '273b420e-09cb-419c-8b57-b393595dba78'
+        with mock.patch.object(utils, 'aws_request', wraps=utils.aws_request) as mocked_aws_request:
+            first = self.core_client.get_project_from_project_task_id(project_task_id)
+            second = self.core_client.get_project_from_project_task_id(project_task_id)
+        self.assertEqual(first, second)
+        self.assertIn(project_task_id, [t['id'] for t in first['tasks']])
+        self.assertEqual(1, mocked_aws_request.call_count)
+
+    def test_task_index_reloaded_with_project_list(self):
+        project_lists = [
+            [{'id': 'project-1', 'tasks': [{'id': 'task-1'}, {'id': 'task-2'}]}],
+            [{'id': 'project-1', 'tasks': [{'id': 'task-1'}]}],
+        ]
+        # the last list is requested twice, as missing tasks trigger a reload
+        responses = [{'statusCode': HTTPStatus.OK, 'body': json.dumps(x)} for x in project_lists + project_lists[1:]]
+        with mock.patch.object(utils, 'aws_request', side_effect=responses):
+            self.assertEqual('project-1', self.core_client.get_project_from_project_task_id('task-2')['id'])
+            # the project list expires; the task index must expire with it
+            core_api_utilities._core_api_cache.invalidate((self.core_client.base_url, 'projects'))
+            self.assertEqual(project_lists[1], self.core_client.get_projects())
+            with self.assertRaises(utils.ObjectDoesNotExistError):
+                self.core_client.get_project_from_project_task_id('task-2')
+
+    def test_cached_responses_are_copies(self):
+        projects = self.core_client.get_projects()
+        projects.clear()
+        self.assertTrue(self.core_client.get_projects())
+
+
+class TestAsyncCoreApiUtilities(test_utils.BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.core_client = AsyncCoreApiClient(
+            env_override=local.dev_config.UNIT_TEST_NAMESPACE[1:-1],
+        )
+
+    def run_coroutine(self, coroutine):
+        async def run_and_close_session():
+            try:
+                return await coroutine
+            finally:
+                await utils.close_async_http_session()
+        return asyncio.run(run_and_close_session())
+
+    def test_get_user_by_email_ok(self):
+        result = self.run_coroutine(self.core_client.get_user_by_email(email='delia@email.co.uk'))
+        self.assertEqual('35224bd5-f8a8-41f6-8502-f96e12d6ddde', result['id'])
+
+    def test_get_user_by_email_not_found(self):
+        with self.assertRaises(AssertionError):
+            self.run_coroutine(self.core_client.get_user_by_email(email='non_existent@email.co.uk'))
+
+    def test_concurrent_calls(self):
+        async def get_users():
+            return await asyncio.gather(*[self.core_client.get_user_id_by_email(email='delia@email.co.uk') for _ in range(5)])
+        result = self.run_coroutine(get_users())
+        self.assertEqual(['35224bd5-f8a8-41f6-8502-f96e12d6ddde'] * 5, result)
+
+
+class TestSharedApiCalls(test_utils.BaseTestCase):
+    response = {'statusCode': HTTPStatus.OK, 'body': '{"id": "35224bd5-f8a8-41f6-8502-f96e12d6ddde"}'}
+
+    def test_sync_and_async_clients_send_same_request(self):
+        env = local.dev_config.UNIT_TEST_NAMESPACE[1:-1]
+        with mock.patch.object(utils, 'aws_request', return_value=self.response) as mocked_aws_request:
+            sync_result = CoreApiClient(env_override=env).get_user_by_email(email='delia@email.co.uk')
+
+        async def async_response(**kwargs):
+            return self.response
+
+        with mock.patch.object(utils, 'async_aws_request', side_effect=async_response) as mocked_async_aws_request, \
+                mock.patch.object(utils, 'get_secret', return_value={'aws-api-key': 'test-key'}):
+            async_result = asyncio.run(AsyncCoreApiClient(env_override=env).get_user_by_email(email='delia@email.co.uk'))
+        self.assertEqual(sync_result, async_result)
+        sync_kwargs = mocked_aws_request.call_args.kwargs
+        async_kwargs = mocked_async_aws_request.call_args.kwargs
+        self.assertEqual('test-key', async_kwargs.pop('aws_api_key'))
+        self.assertEqual(sync_kwargs, async_kwargs)
+
+    def test_async_client_fetches_api_key_outside_event_loop(self):
+        import threading
+        secret_threads = list()
+
+        def get_secret(secret_name):
+            secret_threads.append(threading.current_thread())
+            return {'aws-api-key': 'test-key'}
+
+        async def get_key_twice(client):
+            return await client.get_aws_api_key(), await client.get_aws_api_key()
+
+        client = AsyncCoreApiClient(env_override=local.dev_config.UNIT_TEST_NAMESPACE[1:-1])
+        with mock.patch.object(utils, 'get_secret', side_effect=get_secret):
+            self.assertEqual(('test-key', 'test-key'), asyncio.run(get_key_twice(client)))
+        self.assertEqual(1, len(secret_threads))
+        self.assertIsNot(threading.main_thread(), secret_threads[0])
@@ -15,81 +15,92 @@
 #   A copy of the GNU Affero General Public License is available in the
 #   docs folder of this project.  It is also available www.gnu.org/licenses/
 #
+import copy
+import functools
 import json
+import os
 from http import HTTPStatus
 
 import thiscovery_lib.thiscovery_api_utilities as tau
 import thiscovery_lib.utilities as utils
 
 
-class CoreApiClient(tau.ThiscoveryApiClient):
+CORE_API_CACHE_TTL = float(os.environ.get('CORE_API_CACHE_TTL', 60))  # seconds
+CORE_API_CACHE_MAX_SIZE = int(os.environ.get('CORE_API_CACHE_MAX_SIZE', 256))  # number of cached responses
 
-    @tau.process_response
-    @tau.check_response(HTTPStatus.OK)
-    def get_user_by_email(self, email):
-        return utils.aws_get('v1/user', self.base_url, params={'email': email})
+# Shared by all CoreApiClient instances created with cache=True, so cached responses survive across warm invocations
+_core_api_cache = utils.TtlCache(ttl=CORE_API_CACHE_TTL, max_size=CORE_API_CACHE_MAX_SIZE)
 
-    def get_user_id_by_email(self, email):
-        user = self.get_user_by_email(email=email)
-        return user['id']
 
-    @tau.process_response
-    @tau.check_response(HTTPStatus.OK)
-    def get_projects(self):
-        return utils.aws_get('v1/project', self.base_url, params={})
+def invalidate_core_api_cache():
+    """
+    Removes all responses cached by CoreApiClient instances
+    """
+    _core_api_cache.invalidate()
 
-    @tau.process_response
-    @tau.check_response(HTTPStatus.OK)
-    def get_userprojects(self, user_id):
-        return utils.aws_get('v1/userproject', self.base_url, params={'user_id': user_id})
 
-    @tau.process_response
-    @tau.check_response(HTTPStatus.OK)
-    def list_users_by_project(self, project_id):
-        return utils.aws_get('v1/list-project-users', self.base_url, params={'project_id': project_id})
+def user_tasks_as_list(user_task_info):
+    if isinstance(user_task_info, dict):
+        return [user_task_info]
+    else:  # user_task_info is list
+        return user_task_info
 
-    @tau.process_response
-    @tau.check_response(HTTPStatus.OK)
-    def _list_user_tasks(self, query_parameter):
-        return utils.aws_get('v1/usertask', self.base_url, params=query_parameter)
 
-    def list_user_tasks(self, query_parameter):
-        """
-        Args:
-            query_parameter (dict): use either 'user_id' or 'anon_user_task_id' as key
+def find_user_task_id_for_project(user_tasks, project_task_id):
+    for user_task in user_tasks:
+        if user_task['project_task_id'] == project_task_id:
+            return user_task['user_task_id']
 
-        Returns:
-        """
-        user_task_info = self._list_user_tasks(query_parameter=query_parameter)
-        if isinstance(user_task_info, dict):
-            return [user_task_info]
-        else:  # user_task_info is list
-            return user_task_info
 
-    def get_user_task_id_for_project(self, user_id, project_task_id):
-        result = self.list_user_tasks(query_parameter={'user_id': user_id})
-        for user_task in result:
-            if user_task['project_task_id'] == project_task_id:
-                return user_task['user_task_id']
+def find_user_task_by_anon_user_task_id(user_tasks, anon_user_task_id):
+    for user_task in user_tasks:
+        if user_task['anon_user_task_id'] == anon_user_task_id:
+            return user_task
+
+
+def find_project_by_project_task_id(project_list, project_task_id):
+    for project in project_list:
+        for t in project['tasks']:
+            if t['id'] == project_task_id:
+                return project
+    raise utils.ObjectDoesNotExistError(f'Project task {project_task_id} not found', details={})
 
-    def get_user_task_from_anon_user_task_id(self, anon_user_task_id):
-        result = self.list_user_tasks(query_parameter={
-            'anon_user_task_id': anon_user_task_id
-        })
-        for user_task in result:
-            if user_task['anon_user_task_id'] == anon_user_task_id:
-                return user_task
 
-    @tau.check_response(HTTPStatus.NO_CONTENT)
+class CoreApiCalls:
+    """
+    Core API calls shared by CoreApiClient and AsyncCoreApiClient (see tau.api_call)
+    """
+
+    @tau.api_call(HTTPStatus.OK, process=True)
+    def get_user_by_email(self, email):
+        return dict(method='GET', endpoint_url='v1/user', params={'email': email})
+
+    @tau.api_call(HTTPStatus.OK, process=True)
+    def get_projects(self):
+        return dict(method='GET', endpoint_url='v1/project', params={})
+
+    @tau.api_call(HTTPStatus.OK, process=True)
+    def get_userprojects(self, user_id):
+        return dict(method='GET', endpoint_url='v1/userproject', params={'user_id': user_id})
+
+    @tau.api_call(HTTPStatus.OK, process=True)
+    def list_users_by_project(self, project_id):
+        return dict(method='GET', endpoint_url='v1/list-project-users', params={'project_id': project_id})
+
+    @tau.api_call(HTTPStatus.OK, process=True)
+    def _list_user_tasks(self, query_parameter):
+        return dict(method='GET', endpoint_url='v1/usertask', params=query_parameter)
+
+    @tau.api_call(HTTPStatus.NO_CONTENT)
     def set_user_task_completed(self, user_task_id=None, anon_user_task_id=None):
         if user_task_id is not None:
-            return utils.aws_request('PUT', 'v1/user-task-completed', self.base_url, params={'user_task_id': user_task_id})
+            return dict(method='PUT', endpoint_url='v1/user-task-completed', params={'user_task_id': user_task_id})
         elif anon_user_task_id is not None:
-            return utils.aws_request('PUT', 'v1/user-task-completed', self.base_url, params={
+            return dict(method='PUT', endpoint_url='v1/user-task-completed', params={
                 'anon_user_task_id': anon_user_task_id
             })
 
-    @tau.check_response(HTTPStatus.NO_CONTENT, HTTPStatus.METHOD_NOT_ALLOWED)
+    @tau.api_call(HTTPStatus.NO_CONTENT, HTTPStatus.METHOD_NOT_ALLOWED)
     def send_transactional_email(self, template_name, **kwargs):
         """
         Calls the send-transactional-email endpoint. Appends 'NA_' to template_name
@@ -108,12 +119,132 @@ class CoreApiClient(tau.ThiscoveryApiClient):
         if utils.running_unit_tests():
             email_dict['template_name'] = f'NA_{template_name}'
         self.logger.debug("Transactional email API call", extra={'email_dict': email_dict})
-        return utils.aws_post('v1/send-transactional-email', self.base_url, request_body=json.dumps(email_dict))
+        return dict(method='POST', endpoint_url='v1/send-transactional-email', data=json.dumps(email_dict))
+
+
+class CoreApiClient(CoreApiCalls, tau.ThiscoveryApiClient):
+
+    def __init__(self, correlation_id=None, env_override=None, cache=False):
+        """
+        Args:
+            correlation_id:
+            env_override:
+            cache (bool): if True, responses of get_projects, get_userprojects, list_users_by_project and
+                    list_user_tasks are cached in memory for CORE_API_CACHE_TTL seconds, and project task ids are
+                    looked up in an index of the cached project list. Use only where data up to CORE_API_CACHE_TTL
+                    seconds old is acceptable
+        """
+        super().__init__(correlation_id=correlation_id, env_override=env_override)
+        self.cache = cache
+
+    def _cached(self, key, loader, copy_result=True):
+        """
+        Returns loader() or, if caching is enabled, its cached value. Callers get their own copy unless copy_result
+        is False, so they cannot modify the cached value
+        """
+        if not self.cache:
+            return loader()
+        result = _core_api_cache.get_or_load((self.base_url, *key), loader)
+        if copy_result:
+            return copy.deepcopy(result)
+        return result
+
+    def get_user_id_by_email(self, email):
+        user = self.get_user_by_email(email=email)
+        return user['id']
+
+    def get_projects(self):
+        if not self.cache:
+            return super().get_projects()
+        projects, _ = self._get_projects_with_task_index()
+        return copy.deepcopy(projects)
+
+    def _get_projects_with_task_index(self):
+        """
+        Returns:
+            Tuple (project list, dictionary mapping project task ids to projects). Both are cached under the same key,
+            so the index is always derived from the cached project list
+        """
+        def load():
+            projects = super(CoreApiClient, self).get_projects()
+            return projects, {t['id']: project for project in projects for t in project['tasks']}
+        return self._cached(('projects',), load, copy_result=False)
+
+    def get_userprojects(self, user_id):
+        return self._cached(('userprojects', user_id), functools.partial(super().get_userprojects, user_id))
+
+    def list_users_by_project(self, project_id):
+        return self._cached(('project_users', project_id), functools.partial(super().list_users_by_project, project_id))
+
+    def list_user_tasks(self, query_parameter):
+        """
+        Args:
+            query_parameter (dict): use either 'user_id' or 'anon_user_task_id' as key
+
+        Returns:
+        """
+        return user_tasks_as_list(self._cached(
+            ('user_tasks', *sorted(query_parameter.items())),
+            functools.partial(self._list_user_tasks, query_parameter=query_parameter),
+        ))
+
+    def get_user_task_id_for_project(self, user_id, project_task_id):
+        result = self.list_user_tasks(query_parameter={'user_id': user_id})
+        return find_user_task_id_for_project(result, project_task_id)
+
+    def get_user_task_from_anon_user_task_id(self, anon_user_task_id):
+        result = self.list_user_tasks(query_parameter={
+            'anon_user_task_id': anon_user_task_id
+        })
+        return find_user_task_by_anon_user_task_id(result, anon_user_task_id)
+
+    def set_user_task_completed(self, user_task_id=None, anon_user_task_id=None):
+        if self.cache:
+            # cached user tasks (and projects) may include this task's status
+            invalidate_core_api_cache()
+        return super().set_user_task_completed(user_task_id=user_task_id, anon_user_task_id=anon_user_task_id)
 
     def get_project_from_project_task_id(self, project_task_id):
-        project_list = self.get_projects()
-        for project in project_list:
-            for t in project['tasks']:
-                if t['id'] == project_task_id:
-                    return project
-        raise utils.ObjectDoesNotExistError(f'Project task {project_task_id} not found', details={})
+        if self.cache:
+            _, project_task_index = self._get_projects_with_task_index()
+            if project_task_id not in project_task_index:
+                # the task may have been created after the project list was cached
+                _core_api_cache.invalidate((self.base_url, 'projects'))
+                _, project_task_index = self._get_projects_with_task_index()
+            if project_task_id in project_task_index:
+                return copy.deepcopy(project_task_index[project_task_id])
+        return find_project_by_project_task_id(self.get_projects(), project_task_id)
+
+
+class AsyncCoreApiClient(CoreApiCalls, tau.AsyncThiscoveryApiClient):
+    """
+    Coroutine version of CoreApiClient. All instances running in the same event loop share a connection pool, so
+    many calls can be made concurrently, e.g.:
+        users = await asyncio.gather(*[client.get_user_by_email(x) for x in emails])
+    """
+
+    async def get_user_id_by_email(self, email):
+        user = await self.get_user_by_email(email=email)
+        return user['id']
+
+    async def list_user_tasks(self, query_parameter):
+        """
+        Args:
+            query_parameter (dict): use either 'user_id' or 'anon_user_task_id' as key
+
+        Returns:
+        """
+        return user_tasks_as_list(await self._list_user_tasks(query_parameter=query_parameter))
+
+    async def get_user_task_id_for_project(self, user_id, project_task_id):
+        result = await self.list_user_tasks(query_parameter={'user_id': user_id})
+        return find_user_task_id_for_project(result, project_task_id)
+
+    async def get_user_task_from_anon_user_task_id(self, anon_user_task_id):
+        result = await self.list_user_tasks(query_parameter={
+            'anon_user_task_id': anon_user_task_id
+        })
+        return find_user_task_by_anon_user_task_id(result, anon_user_task_id)
+
+    async def get_project_from_project_task_id(self, project_task_id):
+        return find_project_by_project_task_id(await self.get_projects(), project_task_id)
@@ -15,24 +15,215 @@
 #   A copy of the GNU Affero General Public License is available in the
 #   docs folder of this project.  It is also available www.gnu.org/licenses/
 #
+import base64
+import functools
+import itertools
 import json
+import queue
+import random
+import threading
+import time
+import weakref
 from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.table import BatchWriter
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 from http import HTTPStatus
 
 import thiscovery_lib.utilities as utils
 
 
+_type_serializer = TypeSerializer()
+_type_deserializer = TypeDeserializer()
+
+
+def filter_expression(attr_name, attr_values):
+    """
+    Builds a boto3 condition matching items whose attribute attr_name equals any of attr_values
+
+    Args:
+        attr_name (str): if None, no filter is built
+        attr_values: a single value (str or bool) or a list of values
+
+    Returns:
+        boto3 condition or None
+    """
+    if attr_name is None:
+        return None
+    # accept string but make it into a list for later processing
+    if isinstance(attr_values, str) or isinstance(attr_values, bool):
+        attr_values = [attr_values]
+    filter_expr = Attr(attr_name).eq(attr_values[0])
+    for value in attr_values[1:]:
+        filter_expr = filter_expr | Attr(attr_name).eq(value)
+    return filter_expr
+
+
+def paginate(operation, page_size=None, max_items=None, exclusive_start_key=None, page_callback=None, **kwargs):
+    """
+    Calls a paginated DynamoDB operation (e.g. Table.scan or Table.query) repeatedly, following LastEvaluatedKey
+
+    Args:
+        operation: callable accepting boto3 scan/query parameters
+        page_size (int): maximum number of items evaluated per request (Limit)
+        max_items (int): stop once this number of items has been returned; Limit is capped at the number of
+                items still required, so the last LastEvaluatedKey is always a valid resume point
+        exclusive_start_key (dict): key to resume from
+        page_callback: optional callable, called with the LastEvaluatedKey of each page after it has been consumed
+        **kwargs: parameters passed to operation on every call
+
+    Yields:
+        Response dictionaries, one per page
+    """
+    start_key = exclusive_start_key
+    remaining = max_items
+    while remaining is None or remaining > 0:
+        request_kwargs = dict(kwargs)
+        limit = page_size
+        if remaining is not None:
+            limit = remaining if limit is None else min(limit, remaining)
+        if limit is not None:
+            request_kwargs['Limit'] = limit
+        if start_key is not None:
+            request_kwargs['ExclusiveStartKey'] = start_key
+        response = operation(**request_kwargs)
+        if remaining is not None:
+            remaining -= len(response.get('Items', []))
+        yield response
+        start_key = response.get('LastEvaluatedKey')
+        if page_callback is not None:
+            page_callback(start_key)
+        if start_key is None:
+            break
+
+
+def encode_cursor(last_evaluated_key):
+    """
+    Encodes a LastEvaluatedKey as an opaque, url-safe pagination cursor
+
+    Args:
+        last_evaluated_key (dict): as returned by DynamoDB query and scan calls
+
+    Returns:
+        str or None (if last_evaluated_key is None)
+    """
+    if last_evaluated_key is None:
+        return None
+    serialized_key = {k: _type_serializer.serialize(v) for k, v in last_evaluated_key.items()}
+    return base64.urlsafe_b64encode(json.dumps(serialized_key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Reverses encode_cursor
+
+    Returns:
+        dict that can be used as ExclusiveStartKey
+    """
+    try:
+        serialized_key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return {k: _type_deserializer.deserialize(v) for k, v in serialized_key.items()}
+    except (ValueError, TypeError, AttributeError):
+        raise utils.DetailedValueError('invalid pagination cursor', {'cursor': cursor})
+
+
+def item_envelope(key, item_type, item_details, item=None, key_name='id', sort_key=None, now=None):
+    """
+    Adds key, type, details and created/modified timestamps to item (see Dynamodb.put_item)
+
+    Returns:
+        item (modified in place, or a new dict if item is None)
+    """
+    if item is None:
+        item = dict()
+    if now is None:
+        now = str(utils.now_with_tz())
+    item[key_name] = str(key)
+    item['type'] = item_type
+    item['details'] = item_details
+    item['created'] = now
+    item['modified'] = now
+    if sort_key:
+        item.update(sort_key)
+    return item
+
+
+DEFAULT_SCAN_SEGMENTS = 4
+BATCH_GET_MAX_KEYS = 100  # https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_BatchGetItem.html
+BATCH_WRITE_MAX_ITEMS = 25  # https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_BatchWriteItem.html
+TRANSACT_WRITE_MAX_ITEMS = 100  # https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_TransactWriteItems.html
+BATCH_MAX_RETRIES = 8
+BATCH_RETRY_BASE_DELAY = 0.05  # seconds
+LEASE_ITEM_TYPE = 'lease'
+
+
+def chunks(iterable, size):
+    """
+    Splits iterable into lists of at most size elements
+    """
+    chunk = list()
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) == size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def backoff_delay(retry_count, base_delay=BATCH_RETRY_BASE_DELAY):
+    """
+    Exponential backoff with full jitter
+    """
+    return random.uniform(0, base_delay * 2 ** retry_count)
+
+
 class Dynamodb(utils.BaseClient):
+    # per-process cache of table resources: {id of the owning dynamodb resource: {(stack_name, aws_namespace,
+    # table_name): table}}. Resources are not thread safe, so get_boto3_client gives each thread its own; keying the
+    # cache by resource ensures tables are only shared by clients of the same thread. Entries are removed when their
+    # resource is garbage collected. Resources compare equal to each other, so they cannot be used as keys directly
+    _table_cache = dict()
+    _table_cache_lock = threading.Lock()
+
     def __init__(self, stack_name='thiscovery-core', correlation_id=None):
         super().__init__('dynamodb', client_type='resource', correlation_id=correlation_id)
         super().get_namespace()
         self.stack_name = stack_name
 
+    @classmethod
+    def _resource_tables(cls, resource):
+        resource_id = id(resource)
+        with cls._table_cache_lock:
+            tables = cls._table_cache.get(resource_id)
+            if tables is None:
+                tables = cls._table_cache[resource_id] = dict()
+                weakref.finalize(resource, cls._table_cache.pop, resource_id, None)
+        return tables
+
     def get_table(self, table_name):
-        table_full_name = '-'.join([self.stack_name, self.aws_namespace, table_name])
-        self.logger.debug('Table full name', extra={'table_full_name': table_full_name})
-        return self.client.Table(table_full_name)
+        tables = self._resource_tables(self.client)
+        cache_key = (self.stack_name, self.aws_namespace, table_name)
+        table = tables.get(cache_key)
+        if table is None:
+            table_full_name = '-'.join(cache_key)
+            self.logger.debug('Table full name', extra={'table_full_name': table_full_name})
+            table = tables[cache_key] = self.client.Table(table_full_name)
+        return table
+
+    @classmethod
+    def clear_table_cache(cls, stack_name=None, aws_namespace=None, table_name=None):
+        """
+        Removes table resources from the cache used by get_table. Arguments left as None match any value, so calling this
+        method without arguments empties the cache
+        """
+        with cls._table_cache_lock:
+            resource_tables = list(cls._table_cache.values())
+        for tables in resource_tables:
+            for key in list(tables.keys()):
+                if all(x is None or x == y for x, y in zip((stack_name, aws_namespace, table_name), key)):
+                    tables.pop(key, None)
 
     def put_item(self, table_name, key, item_type, item_details, item=dict(), update_allowed=False, correlation_id=None, key_name='id', sort_key=None):
         """
@@ -52,15 +243,7 @@ class Dynamodb(utils.BaseClient):
         """
         try:
             table = self.get_table(table_name)
-
-            item[key_name] = str(key)
-            item['type'] = item_type
-            item['details'] = item_details
-            now = str(utils.now_with_tz())
-            item['created'] = now
-            item['modified'] = now
-            if sort_key:
-                item.update(sort_key)
+            item = item_envelope(key, item_type, item_details, item=item, key_name=key_name, sort_key=sort_key)
 
             self.logger.info('dynamodb put', extra={'table_name': table_name, 'item': item, 'correlation_id': self.correlation_id})
             if update_allowed:
@@ -81,6 +264,103 @@ class Dynamodb(utils.BaseClient):
             }
             raise utils.DetailedValueError('Dynamodb raised an error', errorjson)
 
+    def batch_put_items(self, table_name, items, item_type, update_allowed=False, correlation_id=None, key_name='id', table_name_verbatim=False):
+        """
+        Bulk version of put_item. Each item gets the same key, type, details and timestamp envelope as put_item.
+
+        If update_allowed, items are written with a batch_writer (BatchWriteItem requests of BATCH_WRITE_MAX_ITEMS items,
+        with unprocessed items automatically resent); if items share a key, the last one is written. All items must then
+        use the same sort key attributes. Otherwise, items are written in chunks of TRANSACT_WRITE_MAX_ITEMS using
+        TransactWriteItems with an attribute_not_exists condition on each item, so a chunk is only written if none of
+        its items already exist. Chunks written before a failing chunk are not rolled back; the DetailedValueError
+        raised in that case includes committed_count, the number of items already written.
+
+        Args:
+            table_name:
+            items (iterable): dicts containing the put_item parameters key and item_details, and optionally item
+                    (additional attributes), item_type (overrides the item_type parameter) and sort_key
+            item_type (str): default item type
+            update_allowed:
+            correlation_id:
+            key_name:
+            table_name_verbatim:
+
+        Returns:
+            Number of items processed (including any items overwritten by later items with the same key)
+        """
+        if correlation_id is None:
+            correlation_id = self.correlation_id
+        table = self._get_table(table_name, table_name_verbatim)
+        items = iter(items)
+        first_item = next(items, None)
+        if first_item is not None:
+            items = itertools.chain([first_item], items)
+        now = str(utils.now_with_tz())
+
+        def envelope(x):
+            return item_envelope(
+                x['key'],
+                x.get('item_type', item_type),
+                x['item_details'],
+                item=x.get('item'),
+                key_name=key_name,
+                sort_key=x.get('sort_key'),
+                now=now,
+            )
+
+        count = 0
+        if update_allowed:
+            # BatchWriteItem rejects requests that contain the same key twice; keep the last item with each key
+            sort_key_names = sorted((first_item or dict()).get('sort_key') or dict())
+            with table.batch_writer(overwrite_by_pkeys=[key_name] + sort_key_names) as batch:
+                for x in items:
+                    if sorted(x.get('sort_key') or dict()) != sort_key_names:
+                        raise utils.DetailedValueError('All items must use the same sort key attributes', {
+                            'table_name': table_name,
+                            'key': str(x['key']),
+                            'sort_key': x.get('sort_key'),
+                            'expected_sort_key_names': sort_key_names,
+                            'committed_count': count,
+                            'correlation_id': correlation_id,
+                        })
+                    batch.put_item(Item=envelope(x))
+                    count += 1
+        else:
+            for chunk in chunks((envelope(x) for x in items), TRANSACT_WRITE_MAX_ITEMS):
+                try:
+                    self._transact_put_new_items(table.name, table_name, chunk, key_name, correlation_id)
+                except utils.DetailedValueError as err:
+                    err.details['committed_count'] = count
+                    raise
+                count += len(chunk)
+        self.logger.info('dynamodb batch put', extra={'table_name': table_name, 'count': count, 'correlation_id': correlation_id})
+        return count
+
+    def _transact_put_new_items(self, table_full_name, table_name, items, key_name, correlation_id):
+        transact_items = [
+            {
+                'Put': {
+                    'TableName': table_full_name,
+                    'Item': item,
+                    'ConditionExpression': 'attribute_not_exists(#k)',
+                    'ExpressionAttributeNames': {'#k': key_name},
+                }
+            } for item in items
+        ]
+        try:
+            return self.client.meta.client.transact_write_items(TransactItems=transact_items)
+        except ClientError as ex:
+            errorjson = {
+                'error_code': ex.response['Error']['Code'],
+                'table_name': table_name,
+                'keys': [str(x[key_name]) for x in items],
+                'correlation_id': correlation_id,
+            }
+            cancellation_reasons = ex.response.get('CancellationReasons')
+            if cancellation_reasons:
+                errorjson['cancellation_reasons'] = [x.get('Code') for x in cancellation_reasons]
+            raise utils.DetailedValueError('Dynamodb raised an error', errorjson)
+
     def update_item(self, table_name: str, key: str, name_value_pairs: dict, correlation_id=None, key_name='id', sort_key=None, **kwargs):
         """
         https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Table.update_item
@@ -138,57 +418,236 @@ class Dynamodb(utils.BaseClient):
             **kwargs,
         )
 
-    def scan(self, table_name: str, filter_attr_name: str = None, filter_attr_values=None, table_name_verbatim=False):
+    def _get_table(self, table_name, table_name_verbatim=False):
+        if table_name_verbatim:
+            return self.client.Table(table_name)
+        return self.get_table(table_name)
+
+    def iter_scan(self, table_name: str, filter_attr_name: str = None, filter_attr_values=None, table_name_verbatim=False,
+                  page_size=None, max_items=None, exclusive_start_key=None, page_callback=None, **kwargs):
         """
+        Generator version of scan that follows LastEvaluatedKey and yields items one at a time, so
+        tables larger than DynamoDB's 1 MB page limit can be processed without holding them in memory.
+
         https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Table.scan
 
-        Return:
-            A list of dictionaries, each representing an item in the Dynamodb table
-        """
-        if table_name_verbatim:
-            table = self.client.Table(table_name)
-        else:
-            table = self.get_table(table_name)
+        Args:
+            table_name:
+            filter_attr_name:
+            filter_attr_values:
+            table_name_verbatim:
+            page_size (int): maximum number of items evaluated per scan request (Limit)
+            max_items (int): stop after yielding this number of items
+            exclusive_start_key (dict): resume a previous scan from this key
+            page_callback: optional callable; called with the LastEvaluatedKey of each page after all of its
+                    items have been yielded (None when the scan is complete). Use it to checkpoint long scans and
+                    resume them later via exclusive_start_key
+            **kwargs: any other parameters accepted by boto3's Table.scan (e.g. ProjectionExpression)
 
-        # accept string but make it into a list for later processing
-        if isinstance(filter_attr_values, str) or isinstance(filter_attr_values, bool):
-            filter_attr_values = [filter_attr_values]
+        Yields:
+            Dictionaries, each representing an item in the Dynamodb table
+        """
+        table = self._get_table(table_name, table_name_verbatim)
+        filter_expr = filter_expression(filter_attr_name, filter_attr_values)
+        if filter_expr is not None:
+            kwargs['FilterExpression'] = filter_expr
         self.logger.info('dynamodb scan', extra={
             'table_name': table_name,
             'filter_attr_name': filter_attr_name,
             'filter_attr_value': str(filter_attr_values),
             'correlation_id': self.correlation_id})
-        if filter_attr_name is None:
-            response = table.scan()
-        else:
-            filter_expr = Attr(filter_attr_name).eq(filter_attr_values[0])
-            for value in filter_attr_values[1:]:
-                filter_expr = filter_expr | Attr(filter_attr_name).eq(value)
-            response = table.scan(FilterExpression=filter_expr)
-        items = response['Items']
+        for page in paginate(table.scan, page_size=page_size, max_items=max_items, exclusive_start_key=exclusive_start_key,
+                             page_callback=page_callback, **kwargs):
+            yield from page['Items']
+
+    def _scan_segment(self, scan_operation, segment, total_segments, page_handler, progress_callback=None, stop_event=None,
+                      page_size=None, **kwargs):
+        """
+        Scans a single segment of a table, passing each page of items to page_handler
+        """
+        item_count = 0
+        for page in paginate(scan_operation, page_size=page_size, Segment=segment, TotalSegments=total_segments, **kwargs):
+            items = page['Items']
+            item_count += len(items)
+            page_handler(segment, items)
+            if progress_callback is not None:
+                progress_callback(segment, item_count, 'LastEvaluatedKey' not in page)
+            if (stop_event is not None) and stop_event.is_set():
+                break
+        self.logger.debug('dynamodb scan segment complete', extra={
+            'segment': segment, 'total_segments': total_segments, 'count': item_count, 'correlation_id': self.correlation_id})
+        return item_count
+
+    def parallel_scan(self, table_name: str, filter_attr_name: str = None, filter_attr_values=None, table_name_verbatim=False,
+                      total_segments=DEFAULT_SCAN_SEGMENTS, max_workers=None, segment_callback=None, progress_callback=None,
+                      page_size=None, **kwargs):
+        """
+        Scans a table in parallel, splitting it into total_segments segments that are processed by a thread pool.
+
+        https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Scan.html#Scan.ParallelScan
+
+        Args:
+            table_name:
+            filter_attr_name:
+            filter_attr_values:
+            table_name_verbatim:
+            total_segments (int): number of segments the table is split into
+            max_workers (int): size of the thread pool; defaults to total_segments
+            segment_callback: optional callable, called with (segment, items) for each page of results. If provided,
+                    items are not returned to the caller
+            progress_callback: optional callable, called with (segment, item_count, finished) after each page, where
+                    item_count is the number of items scanned so far in that segment
+            page_size (int): maximum number of items evaluated per scan request (Limit)
+            **kwargs: any other parameters accepted by boto3's Table.scan (e.g. ProjectionExpression)
+
+        Notes:
+            Callbacks are called from worker threads.
+
+        Returns:
+            If segment_callback is None, a generator yielding items from all segments as they arrive; otherwise
+            a dict mapping each segment number to the number of items it contained
+        """
+        table = self._get_table(table_name, table_name_verbatim)
+        # resources are not thread safe, but their low-level client is (and it still (de)serialises DynamoDB types)
+        scan_operation = functools.partial(self.client.meta.client.scan, TableName=table.name)
+        filter_expr = filter_expression(filter_attr_name, filter_attr_values)
+        if filter_expr is not None:
+            kwargs['FilterExpression'] = filter_expr
+        if max_workers is None:
+            max_workers = total_segments
+        self.logger.info('dynamodb parallel scan', extra={
+            'table_name': table_name,
+            'filter_attr_name': filter_attr_name,
+            'filter_attr_value': str(filter_attr_values),
+            'total_segments': total_segments,
+            'max_workers': max_workers,
+            'correlation_id': self.correlation_id})
+
+        if segment_callback is None:
+            return self._merged_parallel_scan(scan_operation, total_segments, max_workers, progress_callback, page_size, **kwargs)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                segment: executor.submit(self._scan_segment, scan_operation, segment, total_segments, segment_callback,
+                                         progress_callback, page_size=page_size, **kwargs)
+                for segment in range(total_segments)
+            }
+            return {segment: future.result() for segment, future in futures.items()}
+
+    def _merged_parallel_scan(self, scan_operation, total_segments, max_workers, progress_callback, page_size, **kwargs):
+        pages = queue.Queue(maxsize=2 * max_workers)
+        stop_event = threading.Event()
+
+        def put_page(segment, items):
+            while not stop_event.is_set():
+                try:
+                    pages.put(items, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def scan_segment(segment):
+            try:
+                self._scan_segment(scan_operation, segment, total_segments, put_page, progress_callback, stop_event,
+                                   page_size=page_size, **kwargs)
+            except Exception as err:
+                put_page(segment, err)
+                raise
+            put_page(segment, None)  # signals that this segment is finished
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = [executor.submit(scan_segment, segment) for segment in range(total_segments)]
+        try:
+            finished_segments = 0
+            while finished_segments < total_segments:
+                items = pages.get()
+                if items is None:
+                    finished_segments += 1
+                elif isinstance(items, Exception):
+                    raise items
+                else:
+                    yield from items
+        finally:
+            stop_event.set()
+            executor.shutdown(wait=False)
+
+    def scan(self, table_name: str, filter_attr_name: str = None, filter_attr_values=None, table_name_verbatim=False):
+        """
+        https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Table.scan
+
+        Return:
+            A list of dictionaries, each representing an item in the Dynamodb table. All result pages are
+            included; use iter_scan to process large tables without loading them into memory
+        """
+        items = list(self.iter_scan(table_name, filter_attr_name, filter_attr_values, table_name_verbatim=table_name_verbatim))
         self.logger.info('dynamodb scan result', extra={'count': str(len(items)), 'correlation_id': self.correlation_id})
         return items
 
+    def iter_query(self, table_name, table_name_verbatim=False, filter_attr_name=None, filter_attr_values=None,
+                   page_size=None, max_items=None, exclusive_start_key=None, page_callback=None, **kwargs):
+        """
+        Generator version of query that follows LastEvaluatedKey and yields items one at a time.
+
+        https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Table.query
+
+        Args:
+            table_name:
+            table_name_verbatim:
+            filter_attr_name:
+            filter_attr_values:
+            page_size (int): maximum number of items evaluated per query request (Limit)
+            max_items (int): stop after yielding this number of items
+            exclusive_start_key (dict): resume a previous query from this key
+            page_callback: optional callable; called with the LastEvaluatedKey of each page after all of its
+                    items have been yielded (None when the query is complete)
+            **kwargs: parameters accepted by boto3's Table.query (e.g. KeyConditionExpression, IndexName)
+
+        Yields:
+            Dictionaries, each representing an item in the Dynamodb table
+        """
+        table = self._get_table(table_name, table_name_verbatim)
+        filter_expr = filter_expression(filter_attr_name, filter_attr_values)
+        if filter_expr is not None:
+            kwargs['FilterExpression'] = filter_expr
+        for page in paginate(table.query, page_size=page_size, max_items=max_items, exclusive_start_key=exclusive_start_key,
+                             page_callback=page_callback, **kwargs):
+            yield from page['Items']
+
     def query(self, table_name, table_name_verbatim=False,
               filter_attr_name=None, filter_attr_values=None, **kwargs):
         """
         https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Table.query
+
+        Returns:
+            List of all items matching the query (from all result pages)
         """
-        if table_name_verbatim:
-            table = self.client.Table(table_name)
-        else:
-            table = self.get_table(table_name)
-        if isinstance(filter_attr_values, str) or isinstance(filter_attr_values, bool):
-            filter_attr_values = [filter_attr_values]
+        return list(self.iter_query(table_name, table_name_verbatim, filter_attr_name, filter_attr_values, **kwargs))
 
-        if filter_attr_name is None:
-            response = table.query(**kwargs)
-        else:
-            filter_expr = Attr(filter_attr_name).eq(filter_attr_values[0])
-            for value in filter_attr_values[1:]:
-                filter_expr = filter_expr | Attr(filter_attr_name).eq(value)
-            response = table.query(FilterExpression=filter_expr, **kwargs)
-        return response.get('Items')
+    def query_page(self, table_name, page_size, cursor=None, table_name_verbatim=False,
+                   filter_attr_name=None, filter_attr_values=None, **kwargs):
+        """
+        Fetches a single page of query results, for API endpoints that paginate without re-reading earlier pages.
+
+        Args:
+            table_name:
+            page_size (int): maximum number of items evaluated (Limit)
+            cursor (str): opaque cursor returned by a previous call; None to fetch the first page
+            table_name_verbatim:
+            filter_attr_name:
+            filter_attr_values:
+            **kwargs: parameters accepted by boto3's Table.query (e.g. KeyConditionExpression, IndexName)
+
+        Returns:
+            tuple: (items, next_cursor), where next_cursor is None if there are no more results
+        """
+        table = self._get_table(table_name, table_name_verbatim)
+        filter_expr = filter_expression(filter_attr_name, filter_attr_values)
+        if filter_expr is not None:
+            kwargs['FilterExpression'] = filter_expr
+        if cursor is not None:
+            kwargs['ExclusiveStartKey'] = decode_cursor(cursor)
+        response = table.query(Limit=page_size, **kwargs)
+        return response['Items'], encode_cursor(response.get('LastEvaluatedKey'))
 
     def get_item(self, table_name: str, key: str, correlation_id=None, key_name='id', sort_key=None):
         """
@@ -216,6 +675,82 @@ class Dynamodb(utils.BaseClient):
             # not found
             return None
 
+    def batch_get_items(self, table_name, keys, key_name='id', sort_key_name=None, projection=None, table_name_verbatim=False,
+                        consistent_read=False, max_workers=4, correlation_id=None):
+        """
+        Fetches many items using BatchGetItem. Keys are split into chunks of BATCH_GET_MAX_KEYS, which are requested
+        concurrently; UnprocessedKeys are retried with exponential backoff.
+
+        https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Client.batch_get_item
+
+        Args:
+            table_name:
+            keys (list): partition key values; for tables that use a sort key, dicts specifying both
+                    (e.g. {'data_type': 'test', 'data_sort': '2020-11-12'})
+            key_name:
+            sort_key_name (str): name of the table's sort key, if it has one
+            projection (list): names of attributes to retrieve; key attributes are always included. If None, all
+                    attributes are retrieved
+            table_name_verbatim:
+            consistent_read (bool):
+            max_workers (int): maximum number of concurrent BatchGetItem requests
+            correlation_id:
+
+        Returns:
+            Dict of items keyed by partition key value (or by (partition key value, sort key value) tuples for tables
+            that use a sort key). Keys that were not found are omitted
+        """
+        if correlation_id is None:
+            correlation_id = self.correlation_id
+        table = self._get_table(table_name, table_name_verbatim)
+
+        def item_key(item):
+            if sort_key_name:
+                return item[key_name], item[sort_key_name]
+            return item[key_name]
+
+        key_jsons = dict()
+        for key in keys:
+            key_json = key if isinstance(key, dict) else {key_name: key}
+            key_jsons[item_key(key_json)] = key_json  # BatchGetItem rejects duplicate keys
+
+        request_template = {'ConsistentRead': consistent_read}
+        if projection is not None:
+            attribute_names = [key_name] + ([sort_key_name] if sort_key_name else []) + list(projection)
+            names_expr = {f'#p{i}': name for i, name in enumerate(dict.fromkeys(attribute_names))}
+            request_template['ProjectionExpression'] = ', '.join(names_expr.keys())
+            request_template['ExpressionAttributeNames'] = names_expr
+
+        self.logger.info('dynamodb batch get', extra={'table_name': table_name, 'count': len(key_jsons), 'correlation_id': correlation_id})
+        # resources are not thread safe, but their low-level client is (and it still (de)serialises DynamoDB types)
+        client = self.client.meta.client
+
+        def get_chunk(chunk):
+            request_items = {table.name: {**request_template, 'Keys': chunk}}
+            items = list()
+            retry_count = 0
+            while request_items:
+                response = client.batch_get_item(RequestItems=request_items)
+                items += response['Responses'].get(table.name, [])
+                request_items = response.get('UnprocessedKeys')
+                if request_items:
+                    if retry_count >= BATCH_MAX_RETRIES:
+                        raise utils.DetailedValueError('Dynamodb batch get failed to process all keys', {
+                            'table_name': table_name,
+                            'unprocessed_count': len(request_items[table.name]['Keys']),
+                            'correlation_id': correlation_id,
+                        })
+                    time.sleep(backoff_delay(retry_count))
+                    retry_count += 1
+            return items
+
+        results = dict()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for items in executor.map(get_chunk, chunks(key_jsons.values(), BATCH_GET_MAX_KEYS)):
+                for item in items:
+                    results[item_key(item)] = item
+        return results
+
     def delete_item(self, table_name: str, key: str, correlation_id=None, key_name='id', sort_key=None):
         if correlation_id is None:
             correlation_id = utils.new_correlation_id()
@@ -226,6 +761,72 @@ class Dynamodb(utils.BaseClient):
         self.logger.info('dynamodb delete', extra={'table_name': table_name, 'key': json.dumps(key_json), 'correlation_id': correlation_id})
         return table.delete_item(Key=key_json)
 
+    def acquire_lease(self, table_name, key, owner, duration, key_name='id', correlation_id=None):
+        """
+        Acquires a lease (a lock that expires) stored as an item of table_name, using a conditional write so that at most
+        one owner holds the lease at any time, across processes
+
+        Args:
+            table_name:
+            key: key of the lease item
+            owner (str): unique id of the caller (e.g. a new correlation id)
+            duration (float): seconds after which the lease expires if not released
+            key_name:
+            correlation_id:
+
+        Returns:
+            True if the lease was acquired; False if it is held by another owner
+        """
+        table = self.get_table(table_name)
+        now_ms = int(time.time() * 1000)
+        item = item_envelope(key, LEASE_ITEM_TYPE, dict(), item={
+            'lease_owner': owner,
+            'lease_expires_at': now_ms + int(duration * 1000),
+        }, key_name=key_name)
+        try:
+            table.put_item(
+                Item=item,
+                ConditionExpression='attribute_not_exists(#key) OR lease_expires_at < :now',
+                ExpressionAttributeNames={'#key': key_name},
+                ExpressionAttributeValues={':now': now_ms},
+            )
+        except ClientError as ex:
+            error_code = ex.response['Error']['Code']
+            if error_code == 'ConditionalCheckFailedException':
+                return False
+            raise utils.DetailedValueError('Dynamodb raised an error', {
+                'error_code': error_code,
+                'table_name': table_name,
+                key_name: str(key),
+                'correlation_id': correlation_id,
+            })
+        self.logger.debug('Lease acquired', extra={'table_name': table_name, 'key': key, 'owner': owner,
+                                                   'correlation_id': correlation_id})
+        return True
+
+    def release_lease(self, table_name, key, owner, key_name='id', correlation_id=None):
+        """
+        Releases a lease acquired with acquire_lease, unless it has since expired and been acquired by another owner
+
+        Returns:
+            True if the lease was released; False if owner no longer held it
+        """
+        table = self.get_table(table_name)
+        try:
+            table.delete_item(
+                Key={key_name: key},
+                ConditionExpression='lease_owner = :owner',
+                ExpressionAttributeValues={':owner': owner},
+            )
+        except ClientError as ex:
+            if ex.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                self.logger.warning('Lease not released as it is no longer held by owner', extra={
+                    'table_name': table_name, 'key': key, 'owner': owner, 'correlation_id': correlation_id
+                })
+                return False
+            raise
+        return True
+
     def batch_delete_items(self, table_name, keys):
         """
         Args:
@@ -242,21 +843,51 @@ class Dynamodb(utils.BaseClient):
                     'id': item_id
                 })
 
-    def delete_all(self, table_name: str, table_name_verbatim=False, correlation_id=None, key_name='id', sort_key_name=None):
+    def delete_all(self, table_name: str, table_name_verbatim=False, correlation_id=None, key_name='id', sort_key_name=None,
+                   total_segments=DEFAULT_SCAN_SEGMENTS, max_workers=None):
+        """
+        Deletes all items in a table. The table is scanned in parallel, retrieving only key attributes, and each page of
+        keys is deleted using BatchWriteItem requests from the scanning worker.
+
+        Args:
+            table_name:
+            table_name_verbatim:
+            correlation_id:
+            key_name:
+            sort_key_name (str): name of the table's sort key, if it has one
+            total_segments (int): number of parallel scan segments
+            max_workers (int): size of the thread pool; defaults to total_segments
+
+        Returns:
+            dict: summary containing the number of deleted items and the elapsed time in milliseconds
+        """
         if correlation_id is None:
             correlation_id = utils.new_correlation_id()
-        if table_name_verbatim:
-            table = self.client.Table(table_name)
-        else:
-            table = self.get_table(table_name)
-        items = self.scan(table_name, table_name_verbatim=table_name_verbatim)
-        for item in items:
-            key = item[key_name]
-            key_json = {key_name: key}
-            if sort_key_name:
-                sort_key = item[sort_key_name]
-                key_json.update(
-                    {sort_key_name: sort_key}
-                )
-            self.logger.info('dynamodb delete_all', extra={'table_name': table_name, 'key': key_json, 'correlation_id': correlation_id})
-            table.delete_item(Key=key_json)
+        start_time = utils.get_start_time()
+        table = self._get_table(table_name, table_name_verbatim)
+        client = self.client.meta.client  # thread safe, unlike table resources
+        names_expr = {'#k': key_name}
+        if sort_key_name:
+            names_expr['#s'] = sort_key_name
+
+        def delete_page(segment, keys):
+            with BatchWriter(table.name, client) as batch:
+                for key_json in keys:
+                    batch.delete_item(Key=key_json)
+
+        segment_counts = self.parallel_scan(
+            table.name,
+            table_name_verbatim=True,
+            total_segments=total_segments,
+            max_workers=max_workers,
+            segment_callback=delete_page,
+            ProjectionExpression=', '.join(names_expr.keys()),
+            ExpressionAttributeNames=names_expr,
+        )
+        summary = {
+            'table_name': table_name,
+            'deleted_count': sum(segment_counts.values()),
+            'elapsed_ms': utils.get_elapsed_ms(start_time),
+        }
+        self.logger.info('dynamodb delete_all', extra={**summary, 'correlation_id': correlation_id})
+        return summary
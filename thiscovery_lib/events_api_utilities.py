@@ -19,10 +19,12 @@ import json
 from http import HTTPStatus
 
 import thiscovery_lib.thiscovery_api_utilities as tau
-import thiscovery_lib.utilities as utils
 
 
-class EventsApiClient(tau.ThiscoveryApiClient):
+class EventsApiCalls:
+    """
+    Events API calls shared by EventsApiClient and AsyncEventsApiClient (see tau.api_call)
+    """
 
     def __init__(self, env_override=None, correlation_id=None):
         super().__init__(
@@ -31,10 +33,20 @@ class EventsApiClient(tau.ThiscoveryApiClient):
             api_prefix='events'
         )
 
-    @tau.check_response(HTTPStatus.OK, HTTPStatus.METHOD_NOT_ALLOWED)
+    @tau.api_call(HTTPStatus.OK, HTTPStatus.METHOD_NOT_ALLOWED)
     def post_event(self, event):
-        return utils.aws_post(
+        return dict(
+            method='POST',
             endpoint_url='v1/event',
-            base_url=self.base_url,
-            request_body=json.dumps(event),
+            data=json.dumps(event),
         )
+
+
+class EventsApiClient(EventsApiCalls, tau.ThiscoveryApiClient):
+    pass
+
+
+class AsyncEventsApiClient(EventsApiCalls, tau.AsyncThiscoveryApiClient):
+    """
+    Coroutine version of EventsApiClient
+    """
@@ -18,7 +18,11 @@
 import functools
 import http
 import json
+import os
+import random
 import requests
+import threading
+import time
 from http import HTTPStatus
 from datetime import datetime, timezone
 
@@ -38,9 +42,266 @@ DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 BASE_URL = 'https://api.hubapi.com'
 MOCK_BASE_URL = 'https://0ed709fe-f683-460b-843b-844744e419f9.mock.pstmn.io'
 CONTACTS_ENDPOINT = '/contacts/v1'
+CONTACTS_V3_ENDPOINT = '/crm/v3/objects/contacts'
+CONTACTS_BATCH_MAX_INPUTS = 100  # https://developers.hubspot.com/docs/api/crm/contacts
 INTEGRATIONS_ENDPOINT = '/integrations/v1'
 TASK_SIGNUP_TLE_TYPE_NAME = 'task-signup'
 
+# Tokens are refreshed when they expire in less than this number of seconds, rather than after a 401 response
+HUBSPOT_TOKEN_REFRESH_MARGIN = float(os.environ.get('HUBSPOT_TOKEN_REFRESH_MARGIN', 300))
+HUBSPOT_TOKEN_CACHE_DEFAULT_TTL = 300  # seconds; for tokens whose expiry time is not known
+
+# Requests use the process-wide pooled session of thiscovery_lib.utilities and are retried on throttling (429) and, for
+# idempotent methods, server errors and connection failures, with jittered exponential backoff honouring Retry-After,
+# until HUBSPOT_RETRY_DEADLINE
+HUBSPOT_TIMEOUT = (utils.HTTP_CONNECT_TIMEOUT, float(os.environ.get('HUBSPOT_READ_TIMEOUT', 20)))  # seconds
+HUBSPOT_MAX_RETRIES = int(os.environ.get('HUBSPOT_MAX_RETRIES', 5))
+HUBSPOT_RETRY_BASE_DELAY = float(os.environ.get('HUBSPOT_RETRY_BASE_DELAY', 0.5))  # seconds
+HUBSPOT_RETRY_MAX_DELAY = float(os.environ.get('HUBSPOT_RETRY_MAX_DELAY', 10))  # seconds
+HUBSPOT_RETRY_DEADLINE = float(os.environ.get('HUBSPOT_RETRY_DEADLINE', 30))  # seconds, including all attempts
+RETRY_STATUS_CODES = frozenset([
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+])
+IDEMPOTENT_METHODS = frozenset(['GET', 'PUT', 'DELETE'])
+
+# Only the holder of a lease item in the tokens table refreshes a token; other workers wait for the new token. The
+# holder's token request may start its last attempt just before HUBSPOT_RETRY_DEADLINE and then take up to the connect
+# and read timeouts, so leases never expire before that (plus a margin for saving the new token)
+HUBSPOT_TOKEN_LEASE_MARGIN = 5  # seconds
+HUBSPOT_TOKEN_LEASE_DURATION = max(
+    float(os.environ.get('HUBSPOT_TOKEN_LEASE_DURATION', 60)),
+    HUBSPOT_RETRY_DEADLINE + sum(HUBSPOT_TIMEOUT) + HUBSPOT_TOKEN_LEASE_MARGIN,
+)  # seconds
+# Waiters retry the lease while waiting, so that one of them takes over if the holder's lease expires; they always wait
+# at least HUBSPOT_TOKEN_LEASE_DURATION seconds
+HUBSPOT_TOKEN_LEASE_WAIT = float(os.environ.get('HUBSPOT_TOKEN_LEASE_WAIT', 2 * HUBSPOT_TOKEN_LEASE_DURATION))  # seconds
+HUBSPOT_TOKEN_LEASE_POLL_INTERVAL = 0.25  # seconds
+
+# Process-wide cache of OAuth tokens shared by all HubSpotClient instances; key: (namespace, stack name, token item id);
+# value: (token, expiry time in seconds since the epoch or None if not known)
+_token_cache = utils.TtlCache(ttl=HUBSPOT_TOKEN_CACHE_DEFAULT_TTL)
+
+
+def _token_cache_ttl(value):
+    if value is None:
+        return 0  # do not cache failures to read the token
+    _, expires_at = value
+    if expires_at is None:
+        return HUBSPOT_TOKEN_CACHE_DEFAULT_TTL
+    return max(expires_at - time.time() - HUBSPOT_TOKEN_REFRESH_MARGIN, 0)
+
+
+# region rate limiting
+# Client-side limits per HubSpot app, shared by all clients in the process. HubSpot applies its limits per app across
+# all processes, so the limiters also adapt to the X-HubSpot-RateLimit-* headers of responses. Override with a JSON
+# object in HUBSPOT_RATE_LIMITS, e.g. {"main": {"rate": 5, "capacity": 10}}
+DEFAULT_HUBSPOT_RATE_LIMITS = {
+    'main': {'rate': 10, 'capacity': 10},  # requests per second; burst size
+    'emails': {'rate': 10, 'capacity': 10},
+}
+HUBSPOT_RATE_LIMITS = {
+    **DEFAULT_HUBSPOT_RATE_LIMITS,
+    **json.loads(os.environ.get('HUBSPOT_RATE_LIMITS', '{}')),
+}
+# What clients do when no request budget is left: 'block' (wait for budget, up to HUBSPOT_RATE_LIMIT_MAX_WAIT seconds),
+# 'queue' (reserve the next free slot and wait for it, without limit, in arrival order) or 'fail_fast' (raise
+# HubSpotRateLimitError)
+HUBSPOT_RATE_LIMIT_MODE = os.environ.get('HUBSPOT_RATE_LIMIT_MODE', 'block')
+HUBSPOT_RATE_LIMIT_MAX_WAIT = float(os.environ.get('HUBSPOT_RATE_LIMIT_MAX_WAIT', 10))  # seconds
+# Once HubSpot reports that the daily budget is exhausted, requests fail without being sent; every this number of
+# seconds one request is let through, so that the limiter notices when HubSpot resets the budget (at midnight in the
+# account's time zone)
+HUBSPOT_DAILY_LIMIT_PROBE_INTERVAL = float(os.environ.get('HUBSPOT_DAILY_LIMIT_PROBE_INTERVAL', 300))
+RATE_LIMIT_MODES = ('block', 'queue', 'fail_fast')
+
+
+class HubSpotRateLimitError(DetailedValueError):
+    pass
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: holds up to capacity tokens, refilled at rate tokens per second; each request takes one.
+    Also tracks HubSpot's daily budget when known
+    """
+    def __init__(self, name, rate, capacity):
+        self.name = name
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.daily_remaining = None
+        self.daily_probe_at = None  # monotonic time after which a request may check whether the daily budget was reset
+        self.updated_at = time.monotonic()
+        self.blocked_until = self.updated_at  # no tokens are refilled before this monotonic time
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        refill_from = max(self.updated_at, self.blocked_until)
+        if now > refill_from:
+            self.tokens = min(self.capacity, self.tokens + (now - refill_from) * self.rate)
+        self.updated_at = now
+        return now
+
+    def _check_daily_budget(self):
+        if self.daily_remaining is not None and self.daily_remaining <= 0:
+            now = time.monotonic()
+            if now < self.daily_probe_at:
+                raise HubSpotRateLimitError('HubSpot daily request limit reached', {'app': self.name})
+            # let this request through; its response headers tell whether the budget has been reset
+            self.daily_probe_at = now + HUBSPOT_DAILY_LIMIT_PROBE_INTERVAL
+
+    def try_acquire(self):
+        """
+        Returns:
+            True if a token was taken; False if none is available
+        """
+        with self._lock:
+            self._check_daily_budget()
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def reserve(self):
+        """
+        Takes a token now, borrowing against future refills if necessary, so that concurrent callers are served in
+        arrival order
+
+        Returns:
+            Seconds the caller must wait before using the token
+        """
+        with self._lock:
+            self._check_daily_budget()
+            now = self._refill()
+            self.tokens -= 1
+            return max(self.blocked_until - now, 0) + max(-self.tokens / self.rate, 0)
+
+    def acquire(self, mode=None, max_wait=None):
+        """
+        Takes a token, waiting for it or raising HubSpotRateLimitError depending on mode (see HUBSPOT_RATE_LIMIT_MODE)
+        """
+        if mode is None:
+            mode = HUBSPOT_RATE_LIMIT_MODE
+        if max_wait is None:
+            max_wait = HUBSPOT_RATE_LIMIT_MAX_WAIT
+        if mode == 'queue':
+            delay = self.reserve()
+            if delay:
+                time.sleep(delay)
+            return
+        if mode not in RATE_LIMIT_MODES:
+            raise DetailedValueError(f'Rate limit mode must be one of {RATE_LIMIT_MODES}', {'mode': mode})
+        deadline = time.monotonic() + max_wait
+        while not self.try_acquire():
+            if mode == 'fail_fast':
+                raise HubSpotRateLimitError('HubSpot request rate limit reached', {'app': self.name})
+            now = time.monotonic()
+            delay = max(self.blocked_until - now, 0) + 1 / self.rate
+            if now + delay > deadline:
+                raise HubSpotRateLimitError('Timed out waiting for HubSpot request budget', {
+                    'app': self.name, 'max_wait': max_wait
+                })
+            time.sleep(random.uniform(0.5, 1) * delay)  # jitter, so that waiting threads do not wake up together
+
+    def update_from_headers(self, headers):
+        """
+        Adapts the budget to HubSpot's X-HubSpot-RateLimit-* response headers
+        (https://developers.hubspot.com/docs/api/usage-details#rate-limits), which reflect requests made by all
+        processes using the app. Once HubSpot reports an exhausted budget, no token is granted until the end of
+        the corresponding interval
+        """
+        def header_value(name):
+            try:
+                return float(headers[name])
+            except (KeyError, TypeError, ValueError):
+                return None
+
+        interval_ms = header_value('X-HubSpot-RateLimit-Interval-Milliseconds')
+        maximum = header_value('X-HubSpot-RateLimit-Max')
+        remaining = header_value('X-HubSpot-RateLimit-Remaining')
+        secondly_remaining = header_value('X-HubSpot-RateLimit-Secondly-Remaining')
+        daily_remaining = header_value('X-HubSpot-RateLimit-Daily-Remaining')
+        with self._lock:
+            now = self._refill()
+            if maximum and interval_ms:
+                self.rate = min(self.max_rate, maximum / (interval_ms / 1000))
+            for value, interval in [(remaining, (interval_ms or 10000) / 1000), (secondly_remaining, 1)]:
+                if value is not None:
+                    self.tokens = min(self.tokens, value)
+                    if value <= 0:
+                        self.blocked_until = max(self.blocked_until, now + interval)
+            if daily_remaining is not None:
+                if daily_remaining <= 0 and not (self.daily_remaining is not None and self.daily_remaining <= 0):
+                    self.daily_probe_at = time.monotonic() + HUBSPOT_DAILY_LIMIT_PROBE_INTERVAL
+                self.daily_remaining = daily_remaining
+
+
+_rate_limiters = dict()
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(app):
+    """
+    Returns the process-wide rate limiter of a HubSpot app ('main' or 'emails'), creating it if needed
+    """
+    with _rate_limiters_lock:
+        if app not in _rate_limiters:
+            limits = HUBSPOT_RATE_LIMITS[app]
+            _rate_limiters[app] = TokenBucket(app, rate=limits['rate'], capacity=limits['capacity'])
+        return _rate_limiters[app]
+
+
+def clear_rate_limiters():
+    with _rate_limiters_lock:
+        _rate_limiters.clear()
+# endregion
+
+
+def retry_after_seconds(response):
+    """
+    Returns:
+        The delay requested by the Retry-After header of response (in seconds or as an HTTP date), or None
+    """
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(retry_count, response=None):
+    """
+    Seconds to wait before retrying a request: the server's Retry-After if present, otherwise exponential backoff with
+    full jitter
+    """
+    delay = retry_after_seconds(response)
+    if delay is None:
+        delay = random.uniform(0, min(HUBSPOT_RETRY_MAX_DELAY, HUBSPOT_RETRY_BASE_DELAY * 2 ** retry_count))
+    return delay
+
+
+def clear_hubspot_token_cache():
+    """
+    Discards all HubSpot tokens cached in this process, so that they are read from Dynamodb when next needed
+    """
+    _token_cache.invalidate()
+
 
 # region decorators
 def hubspot_api_error_handler(func):
@@ -76,24 +337,144 @@ class HubSpotClient:
     app_id_secret_name = 'app-id'
     client_id_secret_name = 'client-id'
     client_secret_name = 'client-secret'
+    rate_limit_app = 'main'
 
-    def __init__(self, mock_server=False, correlation_id=None, stack_name='thiscovery-core'):
+    def __init__(self, mock_server=False, correlation_id=None, stack_name='thiscovery-core', rate_limit_mode=None):
+        """
+        Args:
+            mock_server:
+            correlation_id:
+            stack_name:
+            rate_limit_mode (str): 'block', 'queue' or 'fail_fast'; defaults to HUBSPOT_RATE_LIMIT_MODE
+        """
         self.mock_server = mock_server
+        self.rate_limiter = get_rate_limiter(self.rate_limit_app)
+        self.rate_limit_mode = rate_limit_mode
         self.logger = get_logger()
         self.correlation_id = correlation_id
+        self.stack_name = stack_name
         self.ddb = ddb_utils.Dynamodb(stack_name=stack_name)
-        self.tokens = self.get_token_from_database()
-
-        if not self.tokens:
-            self.access_token, self.refresh_token = None, None
-        else:
-            self.access_token = self.tokens['access_token']
-            self.refresh_token = self.tokens['refresh_token']
+        self.tokens, self.access_token, self.refresh_token, self.token_expires_at = None, None, None, None
+        self.load_cached_token()
 
         self.connection_secret = None
         self.app_id = None
 
     # region token management
+    def _token_cache_key(self):
+        return get_aws_namespace(), self.stack_name, self.token_item_id
+
+    def _set_tokens(self, tokens, expires_at):
+        self.tokens = tokens
+        self.access_token = tokens['access_token']
+        self.refresh_token = tokens['refresh_token']
+        self.token_expires_at = expires_at
+
+    def _load_token_with_expiry_from_database(self):
+        """
+        Returns:
+            Tuple (token, expiry time in seconds since the epoch or None if not known), or None if the token could not be
+            read. The expiry time is calculated from the item's modified timestamp, which is set when the token is saved
+        """
+        try:
+            item = self.ddb.get_item(self.tokens_table_name, self.token_item_id, self.correlation_id)
+            tokens = item['details']
+        except:
+            self.logger.warning(f'could not retrieve hubspot token from dynamodb item {self.token_item_id}')
+            return None
+        try:
+            expires_at = datetime.fromisoformat(item['modified']).timestamp() + float(tokens['expires_in'])
+        except (KeyError, TypeError, ValueError):
+            expires_at = None
+        return tokens, expires_at
+
+    def load_cached_token(self):
+        """
+        Sets the token of this instance from the process-wide token cache, reading it from Dynamodb if it is not cached
+        or about to expire. Picks up tokens refreshed by other instances in this process
+        """
+        cached = _token_cache.get_or_load(self._token_cache_key(), self._load_token_with_expiry_from_database,
+                                          ttl_func=_token_cache_ttl)
+        if cached is not None:
+            self._set_tokens(*cached)
+        return cached
+
+    def token_about_to_expire(self):
+        if self.token_expires_at is None:
+            return False  # expiry unknown; rely on 401 responses
+        return self.token_expires_at - time.time() < HUBSPOT_TOKEN_REFRESH_MARGIN
+
+    def ensure_valid_token(self):
+        """
+        Refreshes the token before it expires, so that requests do not fail with 401 responses
+        """
+        self.load_cached_token()
+        if not self.access_token:
+            self.get_new_token_from_hubspot()
+        elif self.token_about_to_expire():
+            self.refresh_access_token()
+
+    def _cache_tokens(self, tokens, expires_at):
+        self._set_tokens(tokens, expires_at)
+        _token_cache.set(self._token_cache_key(), (tokens, expires_at), ttl=_token_cache_ttl((tokens, expires_at)))
+
+    def _pick_up_new_token(self, stale_access_token):
+        """
+        Reads the token from Dynamodb and uses it if another worker has replaced stale_access_token with a valid token
+
+        Returns:
+            True if a new token was found
+        """
+        loaded = self._load_token_with_expiry_from_database()
+        if loaded is None:
+            return False
+        tokens, expires_at = loaded
+        if tokens['access_token'] == stale_access_token:
+            return False
+        if (expires_at is not None) and (expires_at - time.time() < HUBSPOT_TOKEN_REFRESH_MARGIN):
+            return False
+        self._cache_tokens(tokens, expires_at)
+        return True
+
+    def refresh_access_token(self):
+        """
+        Replaces the current access token with a new one. To prevent concurrent workers (e.g. Lambdas that all got 401
+        responses) from each calling HubSpot and overwriting each other's tokens, only the worker holding a lease item
+        in the tokens table calls HubSpot. The others wait for the new token, retrying the lease in case the holder's
+        lease expires, and raise an error if neither happens within HUBSPOT_TOKEN_LEASE_WAIT seconds.
+        """
+        stale_access_token = self.access_token
+        lease_key = f'{self.token_item_id}-refresh-lease'
+        owner = str(utils.new_correlation_id())
+        # wait long enough to retry the lease after the holder's lease has expired
+        wait = max(HUBSPOT_TOKEN_LEASE_WAIT, HUBSPOT_TOKEN_LEASE_DURATION + HUBSPOT_TOKEN_LEASE_POLL_INTERVAL)
+        deadline = time.time() + wait
+        while True:
+            try:
+                lease_acquired = self.ddb.acquire_lease(self.tokens_table_name, lease_key, owner,
+                                                        HUBSPOT_TOKEN_LEASE_DURATION, correlation_id=self.correlation_id)
+            except DetailedValueError:
+                self.logger.warning('Could not acquire HubSpot token refresh lease; retrying',
+                                    extra={'correlation_id': self.correlation_id}, exc_info=True)
+                lease_acquired = False
+
+            if lease_acquired:
+                try:
+                    # the token may have been refreshed between our last read and acquiring the lease
+                    if not self._pick_up_new_token(stale_access_token):
+                        self.get_new_token_from_hubspot()
+                finally:
+                    self.ddb.release_lease(self.tokens_table_name, lease_key, owner, correlation_id=self.correlation_id)
+                return self.tokens
+
+            if time.time() >= deadline:
+                raise DetailedValueError('Timed out waiting for HubSpot token refresh by lease holder', {
+                    'wait': wait, 'correlation_id': self.correlation_id
+                })
+            time.sleep(HUBSPOT_TOKEN_LEASE_POLL_INTERVAL)
+            if self._pick_up_new_token(stale_access_token):
+                return self.tokens
+
     def get_token_from_database(self, item_name=None):
         if item_name is None:
             item_name = self.token_item_id
@@ -180,12 +561,17 @@ class HubSpotClient:
             formData['grant_type'] = "authorization_code"
             formData['code'] = code
 
-        res = requests.post('https://api.hubapi.com/oauth/v1/token', data=formData)
-        self.tokens = res.json()
-        self.access_token = self.tokens['access_token']
-        self.refresh_token = self.tokens['refresh_token']
-
-        self.save_token(self.tokens)
+        request_time = time.time()
+        res = self._request_with_retries('POST', 'https://api.hubapi.com/oauth/v1/token', data=formData)
+        if res.status_code != HTTPStatus.OK:
+            raise DetailedValueError('Hubspot token request returned HTTP code ' + str(res.status_code), {
+                'content': res.content, 'correlation_id': self.correlation_id
+            })
+        tokens = res.json()
+        expires_at = request_time + tokens['expires_in'] if 'expires_in' in tokens else None
+
+        self.save_token(tokens)
+        self._cache_tokens(tokens, expires_at)
         return {**self.tokens, 'app-id': self.app_id}
 
     def get_initial_token_from_hubspot(self):
@@ -218,29 +604,75 @@ class HubSpotClient:
             'Authorization': f'Bearer {self.access_token}',
         }
 
+    def _request_with_retries(self, method, full_url, **kwargs):
+        """
+        Sends a request using the shared HTTP session, retrying throttled (429) and failed requests with jittered
+        exponential backoff (or after the delay requested by Retry-After) for up to HUBSPOT_MAX_RETRIES retries and
+        HUBSPOT_RETRY_DEADLINE seconds. Server errors and connection errors are only retried for idempotent methods,
+        except when the connection could not be established. Each attempt is subject to the app's rate limiter (see
+        get_rate_limiter).
+
+        Returns:
+            The last response received; callers handle its status code
+        """
+        deadline = time.time() + HUBSPOT_RETRY_DEADLINE
+        retry_count = 0
+        while True:
+            result, error = None, None
+            self.rate_limiter.acquire(self.rate_limit_mode)
+            try:
+                with utils.time_dependency_call('hubspot') as call:
+                    result = call.set_response(utils.get_http_session().request(
+                        method=method,
+                        url=full_url,
+                        timeout=HUBSPOT_TIMEOUT,
+                        **kwargs,
+                    ))
+            except (requests.ConnectionError, requests.Timeout) as err:
+                if (method not in IDEMPOTENT_METHODS) and not isinstance(err, requests.ConnectTimeout):
+                    raise
+                error = err
+            else:
+                self.rate_limiter.update_from_headers(result.headers)
+                if result.status_code not in RETRY_STATUS_CODES:
+                    return result
+                if (method not in IDEMPOTENT_METHODS) and (result.status_code != HTTPStatus.TOO_MANY_REQUESTS):
+                    return result  # the request may have been applied before the server error
+
+            delay = retry_delay(retry_count, result)
+            if (retry_count >= HUBSPOT_MAX_RETRIES) or (time.time() + delay > deadline):
+                if error is not None:
+                    raise error
+                return result
+            self.logger.warning('Retrying Hubspot request', extra={
+                'method': method,
+                'url': full_url,
+                'status_code': None if result is None else result.status_code,
+                'error': repr(error),
+                'retry_count': retry_count,
+                'delay': delay,
+                'correlation_id': self.correlation_id,
+            })
+            time.sleep(delay)
+            retry_count += 1
+
     def hubspot_token_request(self, method, url, params={}, data={}):
         """
         Method for requests using token
         """
+        if method not in ['GET', 'POST', 'PUT', 'DELETE']:
+            raise DetailedValueError(f'Support for method {method} not implemented in {__file__}', {})
 
-        if not self.access_token:
-            self.get_new_token_from_hubspot()
+        self.ensure_valid_token()
 
-        success = False
         retry_count = 0
         base_url = BASE_URL
         if self.mock_server:
             base_url = MOCK_BASE_URL
         full_url = base_url + url
-        while not success:
+        while True:
             headers = self.get_token_request_headers()
-            result = requests.request(
-                method=method,
-                url=full_url,
-                params=params,
-                headers=headers,
-                data=json.dumps(data),
-            )
+            result = self._request_with_retries(method, full_url, params=params, headers=headers, data=json.dumps(data))
             self.logger.info('Logging request and result',
                              extra={
                                  'request': {
@@ -250,28 +682,22 @@ class HubSpotClient:
                                  },
                                  'result': result.text
                              })
-            if method in ['POST', 'PUT', 'DELETE']:
-                if result.status_code in [HTTPStatus.OK, HTTPStatus.NO_CONTENT, HTTPStatus.CREATED]:
-                    success = True
-                elif result.status_code == HTTPStatus.UNAUTHORIZED and retry_count <= 1:
-                    self.get_new_token_from_hubspot(self.refresh_token)
-                    retry_count += 1
-                    # and loop to retry
-                else:
-                    errorjson = {'url': url, 'result': result, 'content': result.content}
-                    raise DetailedValueError('Hubspot call returned HTTP code ' + str(result.status_code), errorjson)
-            elif method in ['GET']:
-                if result.status_code in [HTTPStatus.NOT_FOUND]:
-                    self.logger.warning(f'Content not found; returning None',
-                                        extra={'result.status_code': result.status_code, 'result.content': result.content})
-                    return None
-                else:
-                    result = result.json()
-                success = True
+            if result.status_code in [HTTPStatus.OK, HTTPStatus.NO_CONTENT, HTTPStatus.CREATED, HTTPStatus.ACCEPTED,
+                                      HTTPStatus.MULTI_STATUS]:
+                if method == 'GET':
+                    return result.json()
+                return result
+            elif method == 'GET' and result.status_code == HTTPStatus.NOT_FOUND:
+                self.logger.warning(f'Content not found; returning None',
+                                    extra={'result.status_code': result.status_code, 'result.content': result.content})
+                return None
+            elif result.status_code == HTTPStatus.UNAUTHORIZED and retry_count <= 1:
+                self.refresh_access_token()
+                retry_count += 1
+                # and loop to retry
             else:
-                raise DetailedValueError(f'Support for method {method} not implemented in {__file__}')
-
-        return result
+                errorjson = {'url': url, 'result': result, 'content': result.content}
+                raise DetailedValueError('Hubspot call returned HTTP code ' + str(result.status_code), errorjson)
 
     def get(self, url):
         return self.hubspot_token_request('GET', url)
@@ -305,13 +731,7 @@ class HubSpotClient:
             'Content-Type': 'application/json',
         }
 
-        result = requests.request(
-            method=method,
-            url=full_url,
-            params=params,
-            headers=headers,
-            data=json.dumps(data),
-        )
+        result = self._request_with_retries(method, full_url, params=params, headers=headers, data=json.dumps(data))
         self.logger.info('Logging request and result',
                          extra={
                              'request': {
@@ -337,6 +757,13 @@ class HubSpotClient:
                                         'result.content': result.content
                                     })
                 return None
+            elif result.status_code != HTTPStatus.OK:
+                errorjson = {
+                    'url': url,
+                    'result': result,
+                    'content': result.content
+                }
+                raise DetailedValueError('Hubspot API call returned HTTP code ' + str(result.status_code), errorjson)
             else:
                 result = result.json()
         else:
@@ -509,17 +936,8 @@ class HubSpotClient:
 
         url = '/contacts/v1/contact/createOrUpdate/email/' + email
 
-        created_timestamp = hubspot_timestamp(new_user['created'])
-
         data = {
-            "properties": [
-                {"property": "email", "value": email},
-                {"property": "firstname", "value": new_user['first_name']},
-                {"property": "lastname", "value": new_user['last_name']},
-                {"property": "thiscovery_id", "value": new_user['id']},
-                {"property": "thiscovery_registered_date", "value": created_timestamp},
-                {"property": "country", "value": new_user['country_name']},
-            ]
+            "properties": self.new_user_properties(new_user)
         }
 
         result = self.post(url=url, data=data)
@@ -535,6 +953,98 @@ class HubSpotClient:
         else:
             return -1, False
 
+    @staticmethod
+    def new_user_properties(new_user):
+        return [
+            {"property": "email", "value": new_user['email']},
+            {"property": "firstname", "value": new_user['first_name']},
+            {"property": "lastname", "value": new_user['last_name']},
+            {"property": "thiscovery_id", "value": new_user['id']},
+            {"property": "thiscovery_registered_date", "value": hubspot_timestamp(new_user['created'])},
+            {"property": "country", "value": new_user['country_name']},
+        ]
+
+    def _batch_contacts_by_email(self, operation, property_changes_by_email):
+        """
+        Creates or updates contacts identified by email using the CRM v3 batch endpoints, in chunks of
+        CONTACTS_BATCH_MAX_INPUTS contacts
+
+        Args:
+            operation (str): 'upsert' or 'update'
+            property_changes_by_email (dict): property changes (list of {"property": ..., "value": ...} dicts, as used
+                    by the v1 contacts API) keyed by email
+
+        Returns:
+            Dictionary keyed by email of dicts with keys 'vid' (None if not known), 'isNew' and 'error' (None if
+            successful). A whole chunk fails with the same error if HubSpot rejects it or the request fails; results
+            of the other chunks are still returned
+        """
+        results = {email: {'vid': None, 'isNew': False, 'error': None} for email in property_changes_by_email}
+        emails_by_lowercase = {email.lower(): email for email in property_changes_by_email}  # HubSpot lowercases emails
+        inputs = [
+            {
+                'idProperty': 'email',
+                'id': email,
+                'properties': {
+                    **{x['property']: x['value'] for x in property_changes},
+                    'email': email,  # so that results can be matched to inputs
+                },
+            } for email, property_changes in property_changes_by_email.items()
+        ]
+        for i in range(0, len(inputs), CONTACTS_BATCH_MAX_INPUTS):
+            chunk = inputs[i:i + CONTACTS_BATCH_MAX_INPUTS]
+            try:
+                response = self.post(f'{CONTACTS_V3_ENDPOINT}/batch/{operation}', data={'inputs': chunk})
+                content = response.json() if response.content else dict()
+            except (ValueError, requests.RequestException) as err:  # DetailedValueError is a ValueError
+                self.logger.error(f'Batch contact {operation} failed', extra={
+                    'emails': [x['id'] for x in chunk], 'error': repr(err), 'correlation_id': self.correlation_id
+                })
+                for x in chunk:
+                    results[x['id']]['error'] = getattr(err, 'message', repr(err))
+                continue
+            for result in content.get('results', list()):
+                email = emails_by_lowercase.get(str(result.get('properties', dict()).get('email')).lower())
+                if email is not None:
+                    results[email].update({'vid': int(result['id']), 'isNew': result.get('new', False)})
+            for error in content.get('errors', list()):
+                for error_id in error.get('context', dict()).get('ids', list()):
+                    email = emails_by_lowercase.get(str(error_id).lower())
+                    if email is not None:
+                        results[email]['error'] = error.get('message', error.get('category'))
+            for x in chunk:
+                result = results[x['id']]
+                if result['vid'] is None and result['error'] is None:
+                    result['error'] = 'no result returned'
+        return results
+
+    def post_new_users_to_crm(self, new_users):
+        """
+        Batch version of post_new_user_to_crm
+
+        Args:
+            new_users (list): see test_hubspot.TEST_USER_01 for an example of each user
+
+        Returns:
+            Dictionary keyed by email of dicts with keys 'vid', 'isNew' and 'error' (None if successful)
+        """
+        return self._batch_contacts_by_email('upsert', {
+            x['email']: self.new_user_properties(x) for x in new_users
+        })
+
+    def update_contacts_by_email(self, property_changes_by_email):
+        """
+        Batch version of update_contact_by_email
+
+        Args:
+            property_changes_by_email (dict): property changes (in the format used by update_contact_by_email) keyed
+                    by contact email
+
+        Returns:
+            Dictionary keyed by email of dicts with keys 'vid', 'isNew' and 'error' (None if successful)
+        """
+        return self._batch_contacts_by_email('update', property_changes_by_email)
+
     def post_task_signup_to_crm(self, signup_details):
         tle_type_id = self.get_timeline_event_type_id(TASK_SIGNUP_TLE_TYPE_NAME, self.correlation_id)
         tle_details = {
@@ -571,6 +1081,7 @@ class SingleSendClient(HubSpotClient):
     app_id_secret_name = 'emails-app-id'
     client_id_secret_name = 'emails-client-id'
     client_secret_name = 'emails-client-secret'
+    rate_limit_app = 'emails'
 
     def send_email(self, template_id, message, **kwargs):
         """
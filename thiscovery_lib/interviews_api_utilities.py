@@ -19,19 +19,21 @@ import json
 from http import HTTPStatus
 
 import thiscovery_lib.thiscovery_api_utilities as tau
-import thiscovery_lib.utilities as utils
 
 
-class InterviewsApiClient(tau.ThiscoveryApiClient):
+class InterviewsApiCalls:
+    """
+    Interviews API calls shared by InterviewsApiClient and AsyncInterviewsApiClient (see tau.api_call)
+    """
 
     def __init__(self, env_override=None, correlation_id=None):
-        super(InterviewsApiClient, self).__init__(
+        super().__init__(
             correlation_id=correlation_id,
             env_override=env_override,
             api_prefix='interviews',
         )
 
-    @tau.check_response(HTTPStatus.OK)
+    @tau.api_call(HTTPStatus.OK)
     def get_appointments_by_type_ids(self, appointment_type_ids):
         """
         Args:
@@ -45,14 +47,13 @@ class InterviewsApiClient(tau.ThiscoveryApiClient):
         self.logger.debug("Calling interviews API appointments-by-type endpoint", extra={
             'body': body
         })
-        return utils.aws_request(
+        return dict(
             method='GET',
             endpoint_url='v1/appointments-by-type',
-            base_url=self.base_url,
             data=json.dumps(body),
         )
 
-    @tau.check_response(HTTPStatus.OK, HTTPStatus.METHOD_NOT_ALLOWED)
+    @tau.api_call(HTTPStatus.OK, HTTPStatus.METHOD_NOT_ALLOWED)
     def set_interview_url(self, appointment_id, interview_url, event_type, **kwargs):
         body = {
             'appointment_id': appointment_id,
@@ -62,9 +63,18 @@ class InterviewsApiClient(tau.ThiscoveryApiClient):
             **kwargs,
         }
         self.logger.debug("Calling interviews API set-interview-url endpoint", extra={'body': body})
-        return utils.aws_request(
+        return dict(
             method='PUT',
             endpoint_url='v1/set-interview-url',
-            base_url=self.base_url,
             data=json.dumps(body),
         )
+
+
+class InterviewsApiClient(InterviewsApiCalls, tau.ThiscoveryApiClient):
+    pass
+
+
+class AsyncInterviewsApiClient(InterviewsApiCalls, tau.AsyncThiscoveryApiClient):
+    """
+    Coroutine version of InterviewsApiClient
+    """
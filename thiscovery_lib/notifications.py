@@ -79,8 +79,22 @@ def get_notifications_to_clear(datetime_threshold, correlation_id=None, stack_na
         )
 
 
-def get_notifications(filter_attr_name: str = None, filter_attr_values=None, correlation_id=None, stack_name='thiscovery-core'):
+def get_notifications(filter_attr_name: str = None, filter_attr_values=None, correlation_id=None, stack_name='thiscovery-core',
+                      total_segments=None):
+    """
+    Args:
+        filter_attr_name:
+        filter_attr_values:
+        correlation_id:
+        stack_name:
+        total_segments (int): if specified, the notifications table is scanned in parallel using this number of segments
+
+    Returns:
+        List of notifications
+    """
     ddb = ddb_utils.Dynamodb(stack_name=stack_name, correlation_id=correlation_id)
+    if total_segments:
+        return list(ddb.parallel_scan(NOTIFICATION_TABLE_NAME, filter_attr_name, filter_attr_values, total_segments=total_segments))
     notifications = ddb.scan(NOTIFICATION_TABLE_NAME, filter_attr_name, filter_attr_values)
     return notifications
 
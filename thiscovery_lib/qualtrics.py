@@ -44,13 +44,14 @@ class BaseClient:
         }
 
         self.logger.debug('Qualtrics API call', extra={'method': method, 'url': endpoint_url, 'params': params, 'json': data})
-        response = requests.request(
-            method=method,
-            url=endpoint_url,
-            params=params,
-            headers=headers,
-            json=data,
-        )
+        with utils.time_dependency_call('qualtrics') as call:
+            response = call.set_response(requests.request(
+                method=method,
+                url=endpoint_url,
+                params=params,
+                headers=headers,
+                json=data,
+            ))
 
         if response.ok:
             return response.json()
@@ -19,27 +19,38 @@ import json
 from http import HTTPStatus
 
 import thiscovery_lib.thiscovery_api_utilities as tau
-import thiscovery_lib.utilities as utils
 
 
-class SurveysApiClient(tau.ThiscoveryApiClient):
+class SurveysApiCalls:
+    """
+    Surveys API calls shared by SurveysApiClient and AsyncSurveysApiClient (see tau.api_call)
+    """
 
     def __init__(self, env_override=None, correlation_id=None):
-        super(SurveysApiClient, self).__init__(
+        super().__init__(
             env_override=env_override,
             correlation_id=correlation_id,
             api_prefix='surveys'
         )
 
-    @tau.check_response(HTTPStatus.OK, HTTPStatus.METHOD_NOT_ALLOWED)
+    @tau.api_call(HTTPStatus.OK, HTTPStatus.METHOD_NOT_ALLOWED)
     def put_response(self, **kwargs):
         body = {
             **kwargs,
         }
         self.logger.debug("Calling surveys API put_response_api endpoint", extra={'body': body})
-        return utils.aws_request(
+        return dict(
             method='PUT',
             endpoint_url='v1/response',
-            base_url=self.base_url,
             data=json.dumps(body),
         )
+
+
+class SurveysApiClient(SurveysApiCalls, tau.ThiscoveryApiClient):
+    pass
+
+
+class AsyncSurveysApiClient(SurveysApiCalls, tau.AsyncThiscoveryApiClient):
+    """
+    Coroutine version of SurveysApiClient
+    """
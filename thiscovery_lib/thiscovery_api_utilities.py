@@ -38,16 +38,50 @@ class ThiscoveryApiClient:
         else:
             self.base_url = f'https://{env_name}-{api_prefix}api.thiscovery.org/'
 
+    def send_request(self, method, endpoint_url, params=None, data=None):
+        return utils.aws_request(method=method, endpoint_url=endpoint_url, base_url=self.base_url, params=params, data=data)
+
+
+class AsyncThiscoveryApiClient(ThiscoveryApiClient):
+    """
+    Base class of the coroutine versions of API clients. Methods decorated with api_call return coroutines in
+    subclasses of this class
+    """
+
+    def __init__(self, correlation_id=None, env_override=None, api_prefix=''):
+        super().__init__(correlation_id=correlation_id, env_override=env_override, api_prefix=api_prefix)
+        self.aws_api_key = None
+
+    async def get_aws_api_key(self):
+        if self.aws_api_key is None:
+            import asyncio
+            # get_secret may call AWS, so it is run in a thread rather than blocking the event loop
+            secret = await asyncio.get_running_loop().run_in_executor(None, utils.get_secret, 'aws-connection')
+            self.aws_api_key = secret['aws-api-key']
+        return self.aws_api_key
+
+    async def send_request(self, method, endpoint_url, params=None, data=None):
+        return await utils.async_aws_request(method=method, endpoint_url=endpoint_url, base_url=self.base_url,
+                                             params=params, data=data, aws_api_key=await self.get_aws_api_key())
+
+
+def _check_status_code(response, expected_status_codes, func):
+    assert response['statusCode'] in expected_status_codes, \
+        f'API call initiated by {func.__module__}.{func.__name__} ' \
+        f'returned error: {response}'
+    return response
+
+
+def _parse_body(response):
+    return json.loads(response['body'])
+
 
 def check_response(*expected_status_codes):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             response = func(*args, **kwargs)
-            assert response['statusCode'] in expected_status_codes, \
-                f'API call initiated by {func.__module__}.{func.__name__} ' \
-                f'returned error: {response}'
-            return response
+            return _check_status_code(response, expected_status_codes, func)
         return wrapper
     return decorator
 
@@ -56,6 +90,32 @@ def process_response(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         response = func(*args, **kwargs)
-        return json.loads(response['body'])
+        return _parse_body(response)
     return wrapper
 
+
+def api_call(*expected_status_codes, process=False):
+    """
+    Decorator for API client methods that return the arguments of send_request (method, endpoint_url and optionally
+    params and data). The decorated method sends the request with the client's send_request and checks the response
+    status code, as check_response does; if process is True, it returns the parsed response body, as process_response
+    does. Methods of subclasses of AsyncThiscoveryApiClient return a coroutine, so each API call is only defined once
+    for both versions of a client
+    """
+    def decorator(func):
+        def handle_response(response):
+            _check_status_code(response, expected_status_codes, func)
+            if process:
+                return _parse_body(response)
+            return response
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            request = func(self, *args, **kwargs)
+            if isinstance(self, AsyncThiscoveryApiClient):
+                async def send():
+                    return handle_response(await self.send_request(**request))
+                return send()
+            return handle_response(self.send_request(**request))
+        return wrapper
+    return decorator
@@ -15,26 +15,32 @@
 #   A copy of the GNU Affero General Public License is available in the
 #   docs folder of this project.  It is also available www.gnu.org/licenses/
 #
-import boto3
+import atexit
+import calendar
+import collections
+import copy
 import datetime
-import epsagon
 import functools
 import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
 import re
-import requests
 import sys
+import threading
 import uuid
 import traceback
-import validators
+import weakref
 
-from botocore.exceptions import ClientError
-from dateutil import parser, tz
 from http import HTTPStatus
-from pythonjsonlogger import jsonlogger
 from timeit import default_timer as timer
 
+# Heavy dependencies (boto3, botocore, epsagon, requests, validators, dateutil, pythonjsonlogger, asyncio) are imported
+# by the functions that use them, so that importing this module (which every other module does) is cheap and Lambda
+# cold starts only pay for what they use. benchmarks/benchmark_import_time.py measures the import cost of each module.
+
 
 # region constants
 def name2namespace(name):
@@ -197,6 +203,7 @@ def running_on_aws():
 
 
 def now_with_tz():
+    from dateutil import tz
     return datetime.datetime.now(tz.tzlocal())
 
 
@@ -209,6 +216,98 @@ def get_elapsed_ms(start_time):
     return elapsed_ms
 
 
+class TtlCache:
+    """
+    Thread-safe in-memory cache whose entries expire ttl seconds after being stored. If max_size is set, the least
+    recently used entries are evicted when the cache is full
+    """
+
+    def __init__(self, ttl, max_size=None):
+        """
+        Args:
+            ttl (float): default time to live of entries, in seconds
+            max_size (int): maximum number of entries; None for no limit
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()  # key: (value, expiry time, ttl); least recently used first
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at, _ = self._entries[key]
+            except KeyError:
+                return default
+            if expires_at <= timer():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries[key] = (value, timer() + ttl, ttl)
+            self._entries.move_to_end(key)
+            if self.max_size is not None:
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """
+        Removes key from the cache; if key is None, all entries are removed
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_or_load(self, key, loader, ttl_func=None, refresh_window=None):
+        """
+        Returns the cached value of key, calling loader() to obtain (and cache) it if needed.
+
+        Args:
+            key:
+            loader: callable taking no arguments
+            ttl_func: optional callable returning the ttl to use for a given loaded value (e.g. shorter ttls for
+                    negative results); defaults to self.ttl
+            refresh_window (float): if an entry expires in less than this number of seconds (or half its ttl, if
+                    that is shorter), it is refreshed in a background thread while the cached value is returned
+
+        Returns:
+            Cached or loaded value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            now = timer()
+            if (entry is not None) and (entry[1] > now):
+                value, expires_at, ttl = entry
+                self._entries.move_to_end(key)
+                if refresh_window and (expires_at - now < min(refresh_window, ttl / 2)) and (key not in self._refreshing):
+                    self._refreshing.add(key)
+                    threading.Thread(target=self._refresh, args=(key, loader, ttl_func), daemon=True).start()
+                return value
+        return self._load(key, loader, ttl_func)
+
+    def _load(self, key, loader, ttl_func):
+        value = loader()
+        self.set(key, value, ttl=None if ttl_func is None else ttl_func(value))
+        return value
+
+    def _refresh(self, key, loader, ttl_func):
+        try:
+            self._load(key, loader, ttl_func)
+        except Exception:
+            get_logger().warning('Background refresh of cached value failed', extra={'key': str(key), 'traceback': traceback.format_exc()})
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
 def obfuscate_data(input, item_key_path):
     try:
         key = item_key_path[0]
@@ -263,6 +362,7 @@ def validate_uuid(s):
 def validate_utc_datetime(s):
     try:
         # date format should be like '2018-06-12 16:16:56.087895+01'
+        from dateutil import parser
         parser.isoparse(s)
         return s
     except ValueError:
@@ -273,6 +373,7 @@ def validate_utc_datetime(s):
 
 
 def validate_url(s):
+    import validators
     if validators.url(s):
         return s
     else:
@@ -292,6 +393,112 @@ def validate_boolean(s):
         raise DetailedValueError('invalid boolean', errorjson)
 
 
+# region Batch validation
+# Fast paths for the batch validators below. A match means the value is valid; values that do not match are passed to
+# the corresponding per-value validator, so the batch validators accept exactly the same values
+UUID4_RE = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-4[0-9a-fA-F]{3}-[89abAB][0-9a-fA-F]{3}-[0-9a-fA-F]{12}')
+UTC_DATETIME_RE = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})[T ]([01]\d|2[0-3]):[0-5]\d:[0-5]\d(?:[.,]\d{1,9})?(?:Z|[+-](?:[01]\d|2[0-3])(?::?[0-5]\d)?)?',
+    re.ASCII,
+)
+BOOLEAN_VALUES = frozenset(['true', 'True', 'false', 'False', '0', '1'])
+
+
+def _batch_validate(values, fast_path, validator, error_message, raise_errors):
+    """
+    Validates each element of values, using validator only for those elements rejected by fast_path
+
+    Returns:
+        Dictionary mapping the index of each invalid element to its DetailedValueError
+    """
+    errors = dict()
+    for i, v in enumerate(values):
+        if fast_path(v):
+            continue
+        try:
+            validator(v)
+        except DetailedValueError as err:
+            errors[i] = err
+        except TypeError:  # e.g. None; the per-value validators do not all handle this
+            errors[i] = DetailedValueError('invalid value type', {'value': v})
+    if errors and raise_errors:
+        raise DetailedValueError(error_message, {
+            'errors': {i: {'message': err.message, **err.details} for i, err in errors.items()}
+        })
+    return errors
+
+
+def _is_fast_uuid4(s):
+    return isinstance(s, str) and UUID4_RE.fullmatch(s) is not None
+
+
+def _is_fast_utc_datetime(s):
+    if not isinstance(s, str):
+        return False
+    m = UTC_DATETIME_RE.fullmatch(s)
+    if m is None:
+        return False
+    year, month, day = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    if year < 1 or not 1 <= month <= 12 or day < 1:
+        return False
+    return day <= 28 or day <= calendar.monthrange(year, month)[1]
+
+
+def _is_int(s):
+    # int() itself is faster than any regex for this
+    try:
+        int(s)
+        return True
+    except (ValueError, TypeError):
+        return False
+
+
+def _is_boolean(s):
+    try:
+        return s in BOOLEAN_VALUES
+    except TypeError:  # unhashable
+        return False
+
+
+def validate_uuids(values, raise_errors=False):
+    """
+    Batch version of validate_uuid
+
+    Args:
+        values (iterable): Values to validate
+        raise_errors (bool): If True, raise a DetailedValueError listing all invalid values instead of returning them
+
+    Returns:
+        Dictionary mapping the index of each invalid value to the DetailedValueError that validate_uuid would have
+        raised; empty if all values are valid
+    """
+    return _batch_validate(values, _is_fast_uuid4, validate_uuid, 'invalid uuids', raise_errors)
+
+
+def validate_utc_datetimes(values, raise_errors=False):
+    """
+    Batch version of validate_utc_datetime; see validate_uuids for arguments and return value
+    """
+    return _batch_validate(values, _is_fast_utc_datetime, validate_utc_datetime, 'invalid utc format datetimes', raise_errors)
+
+
+def validate_ints(values, raise_errors=False):
+    """
+    Batch version of validate_int; see validate_uuids for arguments and return value
+    """
+    return _batch_validate(values, _is_int, validate_int, 'invalid integers', raise_errors)
+
+
+def validate_booleans(values, raise_errors=False):
+    """
+    Batch version of validate_boolean; see validate_uuids for arguments and return value
+    """
+    return _batch_validate(values, _is_boolean, validate_boolean, 'invalid booleans', raise_errors)
+
+
+# endregion
+
+
 # endregion
 
 
@@ -304,6 +511,7 @@ def setup_default_session(profile_name):
     """
     Set up a default boto3 session, which sets profile_name and region_name if running locally
     """
+    import boto3
     global DEFAULT_SESSION
     if running_on_aws():
         DEFAULT_SESSION = boto3.Session()
@@ -322,6 +530,80 @@ def _get_default_session(profile_name):
     return DEFAULT_SESSION
 
 
+# Process-wide registry of boto3 clients, so that they are reused by all wrapper class instances and across warm Lambda
+# invocations. Resources are kept per thread in _boto3_thread_resources instead, so that they are discarded with their
+# thread; clear_boto3_registry discards those of other threads by bumping _boto3_registry_generation
+_boto3_registry = dict()
+_boto3_registry_lock = threading.Lock()
+_boto3_thread_resources = threading.local()
+_boto3_registry_generation = 0
+
+
+def _new_boto3_client(session, service_name, client_type, **kwargs):
+    if client_type == 'low-level':
+        client = session.client(service_name, **kwargs)
+        return instrument_boto3_client(client) if INVOCATION_METRICS else client
+    elif client_type == 'resource':
+        resource = session.resource(service_name, **kwargs)
+        if INVOCATION_METRICS:
+            instrument_boto3_client(resource.meta.client)
+        return resource
+    else:
+        raise NotImplementedError(f"client_type can only be 'low-level' or 'resource', not {client_type}")
+
+
+def get_boto3_client(service_name, profile_name=None, client_type='low-level', **kwargs):
+    """
+    Returns a boto3 client or resource from the process-wide registry, creating it if needed.
+
+    Low-level clients are thread safe and shared by all threads. Resources are not thread safe
+    (https://boto3.amazonaws.com/v1/documentation/api/latest/guide/resources.html#multithreading-or-multiprocessing-with-resources),
+    so each thread gets its own resource instances, which are discarded when the thread ends.
+
+    Args:
+        service_name (str): AWS service name (e.g. dynamodb, lambda, etc)
+        profile_name (str): Profile in ~/.aws/credentials
+        client_type (str): 'low-level' or 'resource'
+        **kwargs: passed to boto3 session.client or session.resource (e.g. endpoint_url, region_name)
+    """
+    session = _get_default_session(profile_name)
+    registry_key = (service_name, profile_name, client_type, tuple(sorted(kwargs.items())))
+    if client_type == 'resource':
+        if getattr(_boto3_thread_resources, 'generation', None) != _boto3_registry_generation:
+            _boto3_thread_resources.generation = _boto3_registry_generation
+            _boto3_thread_resources.registry = dict()
+        registry = _boto3_thread_resources.registry
+    else:
+        registry = _boto3_registry
+    try:
+        return registry[registry_key]
+    except KeyError:
+        pass
+    except TypeError:  # unhashable kwargs; do not cache
+        return _new_boto3_client(session, service_name, client_type, **kwargs)
+    if registry is not _boto3_registry:  # only used by this thread
+        registry[registry_key] = _new_boto3_client(session, service_name, client_type, **kwargs)
+        return registry[registry_key]
+    with _boto3_registry_lock:
+        if registry_key not in _boto3_registry:
+            _boto3_registry[registry_key] = _new_boto3_client(session, service_name, client_type, **kwargs)
+        return _boto3_registry[registry_key]
+
+
+def clear_boto3_registry():
+    """
+    Discards all clients and resources cached by get_boto3_client, as well as the Dynamodb table resources created from
+    them
+    """
+    from thiscovery_lib.dynamodb_utilities import Dynamodb  # imported here to avoid a circular import
+
+    global _boto3_registry_generation
+    with _boto3_registry_lock:
+        _boto3_registry.clear()
+        _boto3_registry_generation += 1
+    Dynamodb.clear_table_cache()
+
+
 class BaseClient:
     def __init__(self, service_name, profile_name=None, client_type='low-level', correlation_id=None, **kwargs):
         """
@@ -332,13 +614,7 @@ class BaseClient:
         """
         if (profile_name is None) and not running_on_aws():
             profile_name = namespace2profile(get_aws_namespace())
-        session = _get_default_session(profile_name)
-        if client_type == 'low-level':
-            self.client = session.client(service_name, **kwargs)
-        elif client_type == 'resource':
-            self.client = session.resource(service_name, **kwargs)
-        else:
-            raise NotImplementedError(f"client_type can only be 'low-level' or 'resource', not {client_type}")
+        self.client = get_boto3_client(service_name, profile_name=profile_name, client_type=client_type, **kwargs)
         self.logger = get_logger()
         self.aws_namespace = None
         self.correlation_id = correlation_id
@@ -349,6 +625,23 @@ class BaseClient:
         return self.aws_namespace
 
 
+# Process-level SSM parameter cache; set SSM_CACHE_TTL to 0 to disable caching
+SSM_CACHE_TTL = float(os.environ.get('SSM_CACHE_TTL', 300))  # seconds
+SSM_CACHE_REFRESH_WINDOW = float(os.environ.get('SSM_CACHE_REFRESH_WINDOW', 30))  # seconds before expiry when a background refresh starts
+SSM_GET_PARAMETERS_MAX_NAMES = 10  # maximum number of names accepted by ssm get_parameters
+
+_ssm_cache = TtlCache(ttl=SSM_CACHE_TTL)  # key: parameter name (including prefix)
+_ssm_path_cache = TtlCache(ttl=SSM_CACHE_TTL)  # key: (path, recursive); value: {parameter name: value}
+
+
+def invalidate_ssm_cache():
+    """
+    Removes all parameters from the SSM parameter cache, so that they are fetched from AWS when next requested
+    """
+    _ssm_cache.invalidate()
+    _ssm_path_cache.invalidate()
+
+
 class SsmClient(BaseClient):
     def __init__(self):
         super().__init__('ssm')
@@ -358,11 +651,7 @@ class SsmClient(BaseClient):
             prefix = f"/{super().get_namespace()}/"
         return prefix + name
 
-    def get_parameter(self, name, prefix=None):
-        """
-        https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ssm.html#SSM.Client.get_parameter
-        """
-        parameter_name = self._prefix_name(name, prefix)
+    def _fetch_parameter(self, parameter_name):
         self.logger.debug(f'Getting SSM parameter {parameter_name}')
         response = self.client.get_parameter(
             Name=parameter_name,
@@ -370,6 +659,108 @@ class SsmClient(BaseClient):
         assert response['ResponseMetadata']['HTTPStatusCode'] == 200, f'call to boto3.client.get_parameter failed with response: {response}'
         return response['Parameter']['Value']
 
+    def get_parameter(self, name, prefix=None, use_cache=True):
+        """
+        https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ssm.html#SSM.Client.get_parameter
+
+        Parameters are cached in memory for SSM_CACHE_TTL seconds and refreshed in the background shortly before they
+        expire. Set use_cache to False to bypass the cache.
+        """
+        parameter_name = self._prefix_name(name, prefix)
+        if use_cache and SSM_CACHE_TTL > 0:
+            return _ssm_cache.get_or_load(parameter_name, functools.partial(self._fetch_parameter, parameter_name),
+                                          refresh_window=SSM_CACHE_REFRESH_WINDOW)
+        return self._fetch_parameter(parameter_name)
+
+    def _fetch_parameters(self, parameter_names):
+        """
+        Fetches parameters in calls of up to SSM_GET_PARAMETERS_MAX_NAMES names each, caching the results
+
+        Returns:
+            Dictionary of parameter values keyed by parameter name; parameters that do not exist are omitted
+        """
+        values = dict()
+        for names_chunk in [parameter_names[i:i + SSM_GET_PARAMETERS_MAX_NAMES]
+                            for i in range(0, len(parameter_names), SSM_GET_PARAMETERS_MAX_NAMES)]:
+            self.logger.debug('Getting SSM parameters', extra={'names': names_chunk})
+            response = self.client.get_parameters(
+                Names=names_chunk,
+            )
+            if response.get('InvalidParameters'):
+                self.logger.warning('SSM parameters not found', extra={'names': response['InvalidParameters']})
+            for parameter in response['Parameters']:
+                values[parameter['Name']] = parameter['Value']
+        if SSM_CACHE_TTL > 0:
+            for parameter_name, value in values.items():
+                _ssm_cache.set(parameter_name, value)
+        return values
+
+    def get_parameters(self, names, prefix=None, use_cache=True):
+        """
+        https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ssm.html#SSM.Client.get_parameters
+
+        Gets multiple parameters using as few calls to AWS as possible. Cached parameters are not fetched again.
+
+        Args:
+            names (list): Parameter names, without prefix
+            prefix (str): Defaults to the namespace of the current environment
+            use_cache (bool): If False, fetch all parameters from AWS
+
+        Returns:
+            Dictionary of parameter values keyed by name (as passed in names); parameters that do not exist are omitted
+        """
+        parameter_names = {self._prefix_name(name, prefix): name for name in names}
+        if use_cache and SSM_CACHE_TTL > 0:
+            missing = object()
+            to_fetch = [x for x in parameter_names if _ssm_cache.get(x, missing) is missing]
+        else:
+            to_fetch = list(parameter_names)
+        values = self._fetch_parameters(to_fetch) if to_fetch else dict()
+        result = dict()
+        for parameter_name, name in parameter_names.items():
+            if parameter_name in values:
+                result[name] = values[parameter_name]
+            elif parameter_name not in to_fetch:
+                # cached; this also starts a background refresh if the entry is about to expire
+                result[name] = _ssm_cache.get_or_load(parameter_name, functools.partial(self._fetch_parameter, parameter_name),
+                                                      refresh_window=SSM_CACHE_REFRESH_WINDOW)
+        return result
+
+    def _fetch_parameters_by_path(self, path, recursive):
+        self.logger.debug(f'Getting SSM parameters under path {path}')
+        values = dict()
+        for page in self.client.get_paginator('get_parameters_by_path').paginate(Path=path, Recursive=recursive):
+            for parameter in page['Parameters']:
+                values[parameter['Name']] = parameter['Value']
+        if SSM_CACHE_TTL > 0:
+            for parameter_name, value in values.items():
+                _ssm_cache.set(parameter_name, value)
+        return values
+
+    def get_parameters_by_path(self, path=None, recursive=True, use_cache=True):
+        """
+        https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ssm.html#SSM.Client.get_parameters_by_path
+
+        Loads all parameters under path, e.g. to read all configuration of an environment in one go at Lambda start.
+        Loaded parameters are also cached individually, so subsequent get_parameter calls do not call AWS.
+
+        Args:
+            path (str): Defaults to the namespace of the current environment (e.g. /prod/)
+            recursive (bool): If True, include parameters in nested paths
+            use_cache (bool): If False, fetch all parameters from AWS
+
+        Returns:
+            Dictionary of parameter values keyed by full parameter name
+        """
+        if path is None:
+            path = f"/{super().get_namespace()}/"
+        if use_cache and SSM_CACHE_TTL > 0:
+            values = _ssm_path_cache.get_or_load((path, recursive), functools.partial(self._fetch_parameters_by_path, path, recursive),
+                                                 refresh_window=SSM_CACHE_REFRESH_WINDOW)
+        else:
+            values = self._fetch_parameters_by_path(path, recursive)
+        return dict(values)
+
     def put_parameter(self, name, value, prefix=None):
         """
         https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ssm.html#SSM.Client.put_parameter
@@ -383,6 +774,9 @@ class SsmClient(BaseClient):
             Overwrite=True,
         )
         assert response['ResponseMetadata']['HTTPStatusCode'] == 200, f'call to boto3.client.put_parameter failed with response: {response}'
+        if SSM_CACHE_TTL > 0:
+            _ssm_cache.set(parameter_name, value)
+        _ssm_path_cache.invalidate()
         return response
 
 
@@ -421,6 +815,14 @@ class SecretsManager(BaseClient):
             SecretId=secret_id,
         )
 
+    def batch_get_secret_value(self, secret_ids):
+        """
+        https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/secretsmanager.html#SecretsManager.Client.batch_get_secret_value
+        """
+        return self.client.batch_get_secret_value(
+            SecretIdList=secret_ids,
+        )
+
     def create_or_update_secret(self, name, value, prefix=None):
         """
         Creates or updates a secret in AWS Secrets Manager.
@@ -518,28 +920,78 @@ class ColorHandler(logging.StreamHandler):
 
 
 class EpsagonHandler(logging.Handler):
+    """
+    Reports error records to Epsagon, unless running tests outside production and staging.
+
+    Whether tests are running is read from the THISCOVERY_RUNNING_TESTS environment variable or, if that is not set,
+    from secret runtime-parameters. Both that and the namespace check happen when the first record is emitted (not
+    when the logger is created), and the decision is cached.
+    """
     def __init__(self):
         super().__init__()
-        try:
-            self.running_tests = get_secret('runtime-parameters')['running-tests']
-        except TypeError:  # get_secret('runtime-parameters') is None
-            self.running_tests = 'false'
+        self._running_tests = None
+        self._report_errors = None
+        self._resolving = False
+
+    @property
+    def running_tests(self):
+        if self._running_tests is None:
+            running_tests = os.environ.get('THISCOVERY_RUNNING_TESTS')
+            if running_tests is None:
+                try:
+                    running_tests = get_secret('runtime-parameters')['running-tests']
+                except TypeError:  # get_secret('runtime-parameters') is None
+                    running_tests = 'false'
+            self._running_tests = running_tests
+        return self._running_tests
+
+    def report_errors(self):
+        if self._report_errors is None:
+            if (self.running_tests == 'false') or (get_aws_namespace() in [PRODUCTION_NAMESPACE, STAGING_NAMESPACE]):
+                self._report_errors = True
+            elif self.running_tests == 'true':
+                self._report_errors = False
+            else:
+                raise AttributeError(f'Secret runtime-parameters.running-tests is neither "true" nor "false": {self.running_tests}')
+        return self._report_errors
 
     def emit(self, exception_instance):
-        if (self.running_tests == 'false') or (get_aws_namespace() in [PRODUCTION_NAMESPACE, STAGING_NAMESPACE]):
+        if self._resolving:  # error logged while fetching runtime-parameters
+            return
+        self._resolving = True
+        try:
+            report_errors = self.report_errors()
+        finally:
+            self._resolving = False
+        if report_errors:
+            import epsagon
             epsagon.error(exception_instance)
-        elif self.running_tests == 'true':
-            pass
-        else:
-            raise AttributeError(f'Secret runtime-parameters.running-tests is neither "true" nor "false": {self.running_tests}')
 
 
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the handlers of the QueueListener. Records are only passed between threads
+    of the same process, so they do not need to be made picklable.
+
+    Note that values passed in 'extra' are serialised by the listener thread, so they should not be modified after
+    being logged.
+    """
+    def prepare(self, record):
+        return record
+
+
+# Set environment variable THISCOVERY_ASYNC_LOGGING to 'true' to format and write log records on a background thread
+ASYNC_LOGGING = os.environ.get('THISCOVERY_ASYNC_LOGGING', 'false') == 'true'
+
 logger = None
+_log_queue = None
+_log_listener = None
 
 
 def get_logger():
-    global logger
+    global logger, _log_queue, _log_listener
     if logger is None:
+        from pythonjsonlogger import jsonlogger
         logger = logging.getLogger('thiscovery')
         formatter = jsonlogger.JsonFormatter('%(asctime)s %(module)s %(funcName)s %(lineno)d %(name)-2s %(levelname)-8s %(message)s')
         formatter.default_msec_format = '%s.%03d'
@@ -552,6 +1004,14 @@ def get_logger():
         epsagon_handler.setLevel(logging.ERROR)
         epsagon_handler.setFormatter(formatter)
 
+        if ASYNC_LOGGING:
+            _log_queue = queue.Queue()
+            _log_listener = logging.handlers.QueueListener(_log_queue, log_handler, respect_handler_level=True)
+            _log_listener.start()
+            atexit.register(stop_log_listener)
+            log_handler = _DeferredQueueHandler(_log_queue)
+            log_handler.setLevel(logging.DEBUG)
+
         for handler in [log_handler, epsagon_handler]:
             logger.addHandler(handler)
         logger.setLevel(logging.DEBUG)
@@ -559,6 +1019,28 @@ def get_logger():
     return logger
 
 
+def flush_logs():
+    """
+    Blocks until all log records queued for the background logging thread (if THISCOVERY_ASYNC_LOGGING is enabled)
+    have been written
+    """
+    if _log_queue is not None:
+        _log_queue.join()
+
+
+def stop_log_listener():
+    """
+    Writes any queued log records and stops the background logging thread. Subsequent records are written synchronously
+    """
+    global _log_queue, _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        logger.removeHandler(next(h for h in logger.handlers if isinstance(h, _DeferredQueueHandler)))
+        logger.addHandler(_log_listener.handlers[0])
+        _log_queue = None
+        _log_listener = None
+
+
 # endregion
 
 
@@ -580,6 +1062,183 @@ def get_correlation_id(event):
 # endregion
 
 
+# region Invocation metrics
+# Set environment variable THISCOVERY_INVOCATION_METRICS to 'true' to write per-invocation metrics to stdout
+INVOCATION_METRICS = os.environ.get('THISCOVERY_INVOCATION_METRICS', 'false') == 'true'
+METRICS_NAMESPACE = os.environ.get('THISCOVERY_METRICS_NAMESPACE', 'Thiscovery')
+
+
+class InvocationMetrics:
+    """
+    Wall time and per-dependency call counts, errors, latencies and bytes transferred during one lambda invocation.
+    Dependency calls may be recorded from any thread
+    """
+    def __init__(self, function_name, correlation_id=None):
+        self.function_name = function_name
+        self.correlation_id = correlation_id
+        self.start_time = get_start_time()
+        self.dependencies = dict()
+        self._lock = threading.Lock()
+
+    def record(self, dependency, elapsed_ms, bytes_out=0, bytes_in=0, error=False):
+        with self._lock:
+            stats = self.dependencies.setdefault(dependency, {
+                'calls': 0,
+                'errors': 0,
+                'latency_ms': 0.0,
+                'max_latency_ms': 0.0,
+                'bytes_out': 0,
+                'bytes_in': 0,
+            })
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['latency_ms'] += elapsed_ms
+            stats['max_latency_ms'] = max(stats['max_latency_ms'], elapsed_ms)
+            stats['bytes_out'] += bytes_out or 0
+            stats['bytes_in'] += bytes_in or 0
+
+    def as_emf(self):
+        """
+        Returns metrics as a CloudWatch embedded metric format record
+        (https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html)
+        """
+        units = {
+            'calls': 'Count',
+            'errors': 'Count',
+            'latency_ms': 'Milliseconds',
+            'max_latency_ms': 'Milliseconds',
+            'bytes_out': 'Bytes',
+            'bytes_in': 'Bytes',
+        }
+        record = {
+            'function': self.function_name,
+            'correlation_id': self.correlation_id,
+            'duration_ms': get_elapsed_ms(self.start_time),
+        }
+        metrics = [{'Name': 'duration_ms', 'Unit': 'Milliseconds'}]
+        with self._lock:
+            for dependency, stats in sorted(self.dependencies.items()):
+                for stat, value in stats.items():
+                    name = f'{dependency}.{stat}'
+                    record[name] = round(value, 3)
+                    metrics.append({'Name': name, 'Unit': units[stat]})
+        record['_aws'] = {
+            'Timestamp': int(datetime.datetime.now().timestamp() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['function']],
+                'Metrics': metrics,
+            }],
+        }
+        return record
+
+
+# Lambda runs one invocation at a time per execution environment, so a module global (rather than a context variable)
+# also captures calls made from worker threads
+_invocation_metrics = None
+
+
+def start_invocation_metrics(function_name, correlation_id=None):
+    """
+    Starts collecting metrics for a new invocation, unless one is already in progress (e.g. nested lambda_wrapper calls)
+
+    Returns:
+        The new InvocationMetrics instance, or None if metrics are disabled or already being collected
+    """
+    global _invocation_metrics
+    if not INVOCATION_METRICS or _invocation_metrics is not None:
+        return None
+    _invocation_metrics = InvocationMetrics(function_name, correlation_id)
+    return _invocation_metrics
+
+
+def end_invocation_metrics(metrics):
+    """
+    Stops collecting metrics and writes them to stdout as one CloudWatch embedded metric format record
+    """
+    global _invocation_metrics
+    if metrics is None or metrics is not _invocation_metrics:
+        return
+    _invocation_metrics = None
+    print(json.dumps(metrics.as_emf(), default=str), flush=True)
+
+
+def record_dependency_call(dependency, elapsed_ms, bytes_out=0, bytes_in=0, error=False):
+    metrics = _invocation_metrics
+    if metrics is not None:
+        metrics.record(dependency, elapsed_ms, bytes_out=bytes_out, bytes_in=bytes_in, error=error)
+
+
+class time_dependency_call:
+    """
+    Context manager that records the latency of an HTTP call to a dependency in the current invocation's metrics.
+    Bytes in and out are taken from the requests.Response passed to set_response, if any:
+
+        with time_dependency_call('hubspot') as call:
+            call.set_response(requests.request(...))
+    """
+    def __init__(self, dependency):
+        self.dependency = dependency
+        self.response = None
+
+    def set_response(self, response):
+        self.response = response
+        return response
+
+    def __enter__(self):
+        self.start_time = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if _invocation_metrics is None:
+            return
+        elapsed_ms = (timer() - self.start_time) * 1000
+        bytes_out = bytes_in = 0
+        error = exc_type is not None
+        if self.response is not None:
+            body = getattr(self.response.request, 'body', None)
+            bytes_out = len(body) if body else 0
+            bytes_in = len(self.response.content or b'')
+            error = error or self.response.status_code >= 400
+        record_dependency_call(self.dependency, elapsed_ms, bytes_out=bytes_out, bytes_in=bytes_in, error=error)
+
+
+def _before_aws_call(model, params, context, **kwargs):
+    if _invocation_metrics is not None:
+        body = params.get('body')
+        context['thiscovery_call'] = (model.service_model.service_name, timer(), len(body) if body else 0)
+
+
+def _after_aws_call(context, http_response=None, exception=None, **kwargs):
+    call = context.pop('thiscovery_call', None)
+    if call is None:
+        return
+    service_name, start_time, bytes_out = call
+    bytes_in = 0
+    if http_response is not None:
+        # reading http_response.content would consume streaming bodies (e.g. S3 get_object)
+        bytes_in = int(http_response.headers.get('content-length', 0))
+    error = (exception is not None) or (http_response is None) or (http_response.status_code >= 300)
+    record_dependency_call(service_name, (timer() - start_time) * 1000, bytes_out=bytes_out, bytes_in=bytes_in,
+                           error=error)
+
+
+def instrument_boto3_client(client):
+    """
+    Registers botocore event handlers that record the latency and size of each API call of client in the current
+    invocation's metrics
+    """
+    events = client.meta.events
+    # registered first and as specifically as stubs (botocore.stub.Stubber) so that stubbed calls are also timed
+    events.register_first('before-call.*.*', _before_aws_call, unique_id='thiscovery-before-call')
+    events.register('after-call', _after_aws_call, unique_id='thiscovery-after-call')
+    events.register('after-call-error', _after_aws_call, unique_id='thiscovery-after-call-error')
+    return client
+
+
+# endregion
+
+
 # region Secrets processing
 DEFAULT_AWS_REGION = 'eu-west-1'
 
@@ -645,8 +1304,28 @@ def non_prod_env_url_param(target_env='prod'):
         return '&env=' + get_environment_name()
 
 
-def get_secret(secret_name, namespace_override=None):
-    logger = get_logger()
+# Process-level secrets cache; set SECRETS_CACHE_TTL to 0 to disable caching
+SECRETS_CACHE_TTL = float(os.environ.get('SECRETS_CACHE_TTL', 300))  # seconds
+SECRETS_NEGATIVE_CACHE_TTL = float(os.environ.get('SECRETS_NEGATIVE_CACHE_TTL', 30))  # seconds; for secrets that could not be found
+SECRETS_CACHE_REFRESH_WINDOW = float(os.environ.get('SECRETS_CACHE_REFRESH_WINDOW', 30))  # seconds before expiry when a background refresh starts
+
+_secrets_cache = TtlCache(ttl=SECRETS_CACHE_TTL)
+
+
+class _SecretNotFound:
+    """
+    Negative secrets cache entry
+    """
+    pass
+
+
+def _secrets_cache_ttl(value):
+    if isinstance(value, _SecretNotFound):
+        return SECRETS_NEGATIVE_CACHE_TTL
+    return SECRETS_CACHE_TTL
+
+
+def _get_secret_name_and_profile(secret_name, namespace_override=None):
     # need to prepend secret name with namespace...
     profile = None
     if namespace_override is None:
@@ -669,7 +1348,18 @@ def get_secret(secret_name, namespace_override=None):
 
     if namespace is not None:
         secret_name = namespace + secret_name
+    return secret_name, profile
+
+
+def _fetch_secret(secret_name, profile):
+    """
+    Fetches a secret from AWS Secrets Manager
 
+    Returns:
+        The decoded secret, or a _SecretNotFound instance if the secret does not exist. Other errors are raised
+    """
+    from botocore.exceptions import ClientError
+    logger = get_logger()
     logger.info('get_aws_secret: ' + secret_name)
 
     secret = None
@@ -681,6 +1371,7 @@ def get_secret(secret_name, namespace_override=None):
     except ClientError as e:
         if e.response['Error']['Code'] == 'ResourceNotFoundException':
             logger.error("The requested secret " + secret_name + " was not found")
+            return _SecretNotFound()
         elif e.response['Error']['Code'] == 'InvalidRequestException':
             logger.error("The request was invalid due to:" + str(e))
         elif e.response['Error']['Code'] == 'InvalidParameterException':
@@ -690,6 +1381,7 @@ def get_secret(secret_name, namespace_override=None):
         raise
     except:
         logger.error(sys.exc_info()[0])
+        raise
     else:
         # logger.info('get_aws_secret:secret about to decode')
         # Decrypted secret using the associated KMS CMK
@@ -702,8 +1394,113 @@ def get_secret(secret_name, namespace_override=None):
         # logger.info('secret:' + secret)
 
         secret = json.loads(secret)
-    finally:
-        return secret
+    return secret
+
+
+def get_secret(secret_name, namespace_override=None):
+    """
+    Returns a secret from AWS Secrets Manager. Secrets are cached in memory for SECRETS_CACHE_TTL seconds and refreshed
+    in the background shortly before they expire. Secrets that could not be found are cached for SECRETS_NEGATIVE_CACHE_TTL
+    seconds.
+
+    Args:
+        secret_name (str): the secret name, excluding the namespace prefix
+        namespace_override (str): namespace to use instead of the current one
+
+    Returns:
+        The secret (dict), or None if it could not be retrieved
+    """
+    full_secret_name, profile = _get_secret_name_and_profile(secret_name, namespace_override)
+    loader = functools.partial(_fetch_secret, full_secret_name, profile)
+    try:
+        if SECRETS_CACHE_TTL > 0:
+            secret = _secrets_cache.get_or_load((full_secret_name, profile), loader, ttl_func=_secrets_cache_ttl,
+                                                refresh_window=SECRETS_CACHE_REFRESH_WINDOW)
+        else:
+            secret = loader()
+    except Exception:  # errors other than ResourceNotFoundException are logged by _fetch_secret and not cached
+        return None
+
+    if isinstance(secret, _SecretNotFound):
+        return None
+    # callers get their own copy, so they cannot modify the cached value
+    return copy.deepcopy(secret)
+
+
+SECRETS_BATCH_GET_MAX_IDS = 20  # maximum number of secret ids accepted by secretsmanager batch_get_secret_value
+
+
+def _batch_fetch_secrets(full_secret_names, profile):
+    """
+    Fetches secrets with as few calls to batch_get_secret_value as possible and adds them to the secrets cache
+    """
+    logger = get_logger()
+    logger.info('Preloading secrets', extra={'secret_names': full_secret_names})
+    client = SecretsManager(profile_name=profile)
+    for i in range(0, len(full_secret_names), SECRETS_BATCH_GET_MAX_IDS):
+        names_chunk = full_secret_names[i:i + SECRETS_BATCH_GET_MAX_IDS]
+        response = client.batch_get_secret_value(names_chunk)
+        for secret_value in response['SecretValues']:
+            secret = json.loads(secret_value['SecretString'])
+            _secrets_cache.set((secret_value['Name'], profile), secret, ttl=_secrets_cache_ttl(secret))
+        for error in response.get('Errors', list()):
+            if error['ErrorCode'] == 'ResourceNotFoundException':
+                logger.error(f"The requested secret {error['SecretId']} was not found")
+                _secrets_cache.set((error['SecretId'], profile), _SecretNotFound(), ttl=SECRETS_NEGATIVE_CACHE_TTL)
+            else:
+                logger.error('Secret could not be preloaded', extra={'error': error})
+
+
+def preload_secrets(secret_names, namespace_override=None, max_workers=None):
+    """
+    Fetches several secrets into the secrets cache at once, so that subsequent get_secret calls do not call AWS. Use at
+    Lambda initialisation to replace sequential fetches by lazily built clients with a single round trip.
+
+    Secrets are fetched with secretsmanager batch_get_secret_value. If that is not available (older botocore or missing
+    permission), they are fetched concurrently with get_secret_value instead. Secrets already cached are not fetched again.
+
+    Args:
+        secret_names (list): secret names, excluding the namespace prefix
+        namespace_override (str): namespace to use instead of the current one
+        max_workers (int): maximum number of threads used if secrets are fetched concurrently; defaults to one per secret
+
+    Returns:
+        Dictionary mapping each secret name to True if it is now cached or False if it could not be retrieved
+    """
+    if SECRETS_CACHE_TTL <= 0:
+        return {x: False for x in secret_names}
+    cache_keys = {x: _get_secret_name_and_profile(x, namespace_override) for x in secret_names}
+    missing = object()
+    to_fetch = [x for x, key in cache_keys.items() if _secrets_cache.get(key, missing) is missing]
+    if to_fetch:
+        profile = cache_keys[to_fetch[0]][1]
+        full_secret_names = [cache_keys[x][0] for x in to_fetch]
+        try:
+            _batch_fetch_secrets(full_secret_names, profile)
+        except Exception:
+            # e.g. AttributeError if botocore does not support batch_get_secret_value or AccessDeniedException
+            get_logger().warning('Batch retrieval of secrets failed; fetching secrets concurrently',
+                                 extra={'traceback': traceback.format_exc()})
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max_workers or len(to_fetch)) as executor:
+                list(executor.map(functools.partial(get_secret, namespace_override=namespace_override), to_fetch))
+    return {
+        x: not isinstance(_secrets_cache.get(key, _SecretNotFound()), _SecretNotFound) for x, key in cache_keys.items()
+    }
+
+
+def invalidate_secret(secret_name=None, namespace_override=None):
+    """
+    Removes a secret from the secrets cache, so that the next get_secret call fetches it from AWS
+
+    Args:
+        secret_name (str): if None, all cached secrets are invalidated
+        namespace_override (str):
+    """
+    if secret_name is None:
+        _secrets_cache.invalidate()
+    else:
+        _secrets_cache.invalidate(_get_secret_name_and_profile(secret_name, namespace_override))
 
 
 # endregion
@@ -730,9 +1527,22 @@ def load_countries():
     return countries_dict
 
 
+_countries = None
+
+
+def get_countries():
+    """
+    Returns the dictionary of country names keyed by country code, loading it on first use
+    """
+    global _countries
+    if _countries is None:
+        _countries = load_countries()
+    return _countries
+
+
 def get_country_name(country_code):
     try:
-        return countries[country_code]
+        return get_countries()[country_code]
     except KeyError as err:
         errorjson = {
             'country_code': country_code
@@ -740,7 +1550,11 @@ def get_country_name(country_code):
         raise DetailedValueError('invalid country code', errorjson)
 
 
-countries = load_countries()
+def __getattr__(name):
+    # module attribute countries is loaded on first access
+    if name == 'countries':
+        return get_countries()
+    raise AttributeError(f'module {__name__} has no attribute {name}')
 
 
 # endregion
@@ -778,7 +1592,105 @@ def api_error_handler(func):
     return wrapper
 
 
-def lambda_wrapper(func):
+RESULT_LOG_MAX_BYTES = int(os.environ.get('RESULT_LOG_MAX_BYTES', 16384))  # 0 disables truncation by size
+RESULT_LOG_MAX_ITEMS = int(os.environ.get('RESULT_LOG_MAX_ITEMS', 50))  # per list/dict; 0 disables truncation by item count
+RESULT_LOG_SAMPLE_RATE = float(os.environ.get('RESULT_LOG_SAMPLE_RATE', 1))  # fraction of invocations whose result is logged
+# JSON object mapping '<module>.<function name>' of decorated handlers to their own sample rate; e.g. {"projects.list_projects_api": 0.1}
+RESULT_LOG_SAMPLE_RATES = json.loads(os.environ.get('RESULT_LOG_SAMPLE_RATES', '{}'))
+# Comma-separated correlation ids whose invocations are always logged in full
+RESULT_LOG_FULL_CORRELATION_IDS = frozenset(
+    x.strip() for x in os.environ.get('RESULT_LOG_FULL_CORRELATION_IDS', '').split(',') if x.strip()
+)
+
+
+def truncate_for_log(obj, max_bytes=RESULT_LOG_MAX_BYTES, max_items=RESULT_LOG_MAX_ITEMS):
+    """
+    Returns a JSON-serialisable copy of obj no larger than the specified limits. The size of the copy is estimated as
+    it is built, so obj is not serialised here; the log formatter serialises the (smaller) copy once
+
+    Args:
+        obj: Object to truncate
+        max_bytes (int): Approximate maximum size of the JSON representation of the output; once it is reached, long
+                strings are cut and the remaining elements of each list, tuple, set or dict are replaced by a count of
+                omitted items. Zero or None disables this limit
+        max_items (int): Maximum number of elements kept in each list, tuple, set or dict of obj. Zero or None
+                disables this limit
+
+    Returns:
+        Truncated copy of obj
+    """
+    remaining_bytes = max_bytes or float('inf')
+
+    def limit_scalar(o):
+        nonlocal remaining_bytes
+        if o is None or isinstance(o, (bool, int, float)):
+            remaining_bytes -= len(str(o))
+            return o
+        if not isinstance(o, str):
+            o = str(o)
+        if len(o) + 2 > remaining_bytes:
+            marker = f'... [{len(o)} characters truncated]'
+            kept = max(int(remaining_bytes) - 2 - len(marker), 0)
+            o = f'{o[:kept]}... [{len(o) - kept} characters truncated]'
+        remaining_bytes -= len(o) + 2
+        return o
+
+    def limit_items(o):
+        nonlocal remaining_bytes
+        if isinstance(o, dict):
+            truncated = dict()
+            for i, (k, v) in enumerate(o.items()):
+                if (max_items and i >= max_items) or remaining_bytes <= 0:
+                    truncated['__truncated_items__'] = len(o) - i
+                    break
+                key = str(k)
+                remaining_bytes -= len(key) + 4  # quotes, colon and separator
+                truncated[key] = limit_items(v)
+            return truncated
+        if isinstance(o, (list, tuple, set, frozenset)):
+            truncated = list()
+            for i, x in enumerate(o):
+                if (max_items and i >= max_items) or remaining_bytes <= 0:
+                    truncated.append(f'... {len(o) - i} more items')
+                    break
+                remaining_bytes -= 2  # separator
+                truncated.append(limit_items(x))
+            return truncated
+        return limit_scalar(o)
+
+    return limit_items(obj)
+
+
+def lambda_wrapper(func=None, *, max_bytes=None, max_items=None, sample_rate=None):
+    """
+    Decorator for lambda handlers. Adds a correlation id and a logger to the event and logs the result of the handler
+
+    Can be used bare (@lambda_wrapper) or with arguments (@lambda_wrapper(sample_rate=0.1)).
+
+    Args:
+        func: Decorated lambda handler
+        max_bytes (int): Overrides RESULT_LOG_MAX_BYTES for this handler
+        max_items (int): Overrides RESULT_LOG_MAX_ITEMS for this handler
+        sample_rate (float): Overrides RESULT_LOG_SAMPLE_RATE for this handler. Entries in RESULT_LOG_SAMPLE_RATES take
+                precedence over this argument
+
+    Invocations whose correlation id is listed in RESULT_LOG_FULL_CORRELATION_IDS are always logged without truncation.
+
+    If THISCOVERY_INVOCATION_METRICS is 'true', wall time and per-dependency call metrics of each invocation are
+    written to stdout in CloudWatch embedded metric format when the handler returns.
+    """
+    if func is None:
+        return functools.partial(lambda_wrapper, max_bytes=max_bytes, max_items=max_items, sample_rate=sample_rate)
+
+    handler_name = f'{func.__module__}.{func.__name__}'
+    if max_bytes is None:
+        max_bytes = RESULT_LOG_MAX_BYTES
+    if max_items is None:
+        max_items = RESULT_LOG_MAX_ITEMS
+    if sample_rate is None:
+        sample_rate = RESULT_LOG_SAMPLE_RATE
+    sample_rate = float(RESULT_LOG_SAMPLE_RATES.get(handler_name, sample_rate))
+
     @functools.wraps(func)
     def thiscovery_lambda_wrapper(*args, **kwargs):
         logger = get_logger()
@@ -790,17 +1702,30 @@ def lambda_wrapper(func):
         event['correlation_id'] = correlation_id
         event['logger'] = logger
         updated_args = (event, *args[1:])
+        metrics = start_invocation_metrics(os.environ.get('AWS_LAMBDA_FUNCTION_NAME', handler_name), correlation_id)
 
-        result = func(*updated_args, **kwargs)
-        logger.info('Decorated function result', extra={
-            'decorated func module': func.__module__,
-            'decorated func name': func.__name__,
-            'result': result,
-            'func args': args,
-            'func kwargs': kwargs,
-            'correlation_id': correlation_id
-        })
-        return result
+        try:
+            result = func(*updated_args, **kwargs)
+            # decide whether to log before serialising anything
+            full_logging = correlation_id in RESULT_LOG_FULL_CORRELATION_IDS
+            if logger.isEnabledFor(logging.INFO) and (full_logging or random.random() < sample_rate):
+                if full_logging:
+                    truncate = lambda x: x
+                else:
+                    truncate = functools.partial(truncate_for_log, max_bytes=max_bytes, max_items=max_items)
+                logger.info('Decorated function result', extra={
+                    'decorated func module': func.__module__,
+                    'decorated func name': func.__name__,
+                    'result': truncate(result),
+                    'func args': truncate(args),
+                    'func kwargs': truncate(kwargs),
+                    'correlation_id': correlation_id
+                })
+            return result
+        finally:
+            end_invocation_metrics(metrics)
+            # Lambda may freeze the execution environment once the handler returns
+            flush_logs()
 
     return thiscovery_lambda_wrapper
 
@@ -809,7 +1734,67 @@ def lambda_wrapper(func):
 
 
 # region aws api requests
-def aws_request(method, endpoint_url, base_url, params=None, data=None, aws_api_key=None):
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))  # number of hosts whose connections are pooled
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))  # maximum number of connections kept open per host
+HTTP_ASYNC_POOL_MAXSIZE = int(os.environ.get('HTTP_ASYNC_POOL_MAXSIZE', 100))  # maximum number of simultaneous connections of async clients
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))  # seconds
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))  # seconds
+DEFAULT_HTTP_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def _new_http_session(pool_connections=None, pool_maxsize=None):
+    import http.cookiejar
+    import requests
+    import requests.adapters
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_connections or HTTP_POOL_CONNECTIONS,
+        pool_maxsize=pool_maxsize or HTTP_POOL_MAXSIZE,
+    )
+    session = requests.Session()
+    # the session is shared by unrelated clients, so cookies set by one API must not be sent with other requests
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def configure_http_session(pool_connections=None, pool_maxsize=None):
+    """
+    Replaces the shared HTTP session returned by get_http_session with one using the specified pool sizes. The previous
+    session is not closed, as other threads may still be using it; its connections are closed when it is garbage
+    collected
+
+    Args:
+        pool_connections (int): number of hosts whose connections are pooled; defaults to HTTP_POOL_CONNECTIONS
+        pool_maxsize (int): maximum number of connections kept open per host; defaults to HTTP_POOL_MAXSIZE
+
+    Returns:
+        The new session
+    """
+    global _http_session
+    session = _new_http_session(pool_connections, pool_maxsize)
+    with _http_session_lock:
+        _http_session = session
+    return session
+
+
+def get_http_session():
+    """
+    Returns a process-wide requests.Session, so that connections (and TLS sessions) are kept alive and reused by
+    all API clients and across warm Lambda invocations
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                _http_session = _new_http_session()
+    return _http_session
+
+
+def aws_request(method, endpoint_url, base_url, params=None, data=None, aws_api_key=None, timeout=DEFAULT_HTTP_TIMEOUT):
     full_url = base_url + endpoint_url
     headers = {
         'Content-Type': 'application/json'
@@ -821,13 +1806,15 @@ def aws_request(method, endpoint_url, base_url, params=None, data=None, aws_api_
         headers['x-api-key'] = aws_api_key
 
     try:
-        response = requests.request(
-            method=method,
-            url=full_url,
-            params=params,
-            headers=headers,
-            data=data,
-        )
+        with time_dependency_call('thiscovery_api') as call:
+            response = call.set_response(get_http_session().request(
+                method=method,
+                url=full_url,
+                params=params,
+                headers=headers,
+                data=data,
+                timeout=timeout,
+            ))
         return {
             'statusCode': response.status_code,
             'body': response.text
@@ -836,6 +1823,81 @@ def aws_request(method, endpoint_url, base_url, params=None, data=None, aws_api_
         raise err
 
 
+# One aiohttp session (and connection pool) per event loop, shared by all async API clients
+_async_http_sessions = weakref.WeakKeyDictionary()
+
+
+def _import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError('aiohttp is required for async API clients; install thiscovery-lib[async]')
+    return aiohttp
+
+
+def get_async_http_session():
+    """
+    Returns the aiohttp.ClientSession shared by all async API clients running in the current event loop. Must be called
+    from a coroutine
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    session = _async_http_sessions.get(loop)
+    if (session is None) or session.closed:
+        aiohttp = _import_aiohttp()
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_ASYNC_POOL_MAXSIZE),
+            timeout=aiohttp.ClientTimeout(connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT),
+        )
+        _async_http_sessions[loop] = session
+    return session
+
+
+async def close_async_http_session():
+    """
+    Closes the aiohttp session of the current event loop; call before the loop is closed
+    """
+    import asyncio
+    session = _async_http_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def async_aws_request(method, endpoint_url, base_url, params=None, data=None, aws_api_key=None):
+    """
+    Coroutine version of aws_request; returns the same response dict
+    """
+    full_url = base_url + endpoint_url
+    headers = {
+        'Content-Type': 'application/json'
+    }
+
+    if aws_api_key is None:
+        # served from the secrets cache after the first call
+        headers['x-api-key'] = get_secret('aws-connection')['aws-api-key']
+    else:
+        headers['x-api-key'] = aws_api_key
+
+    if params is not None:
+        # requests drops parameters whose value is None; aiohttp does not accept them
+        params = {k: v for k, v in params.items() if v is not None}
+
+    start_time = timer()
+    status_code, body = None, None
+    try:
+        async with get_async_http_session().request(method=method, url=full_url, params=params, headers=headers, data=data) as response:
+            status_code, body = response.status, await response.text()
+            return {
+                'statusCode': status_code,
+                'body': body
+            }
+    finally:
+        record_dependency_call(
+            'thiscovery_api', (timer() - start_time) * 1000, bytes_out=len(data) if data else 0,
+            bytes_in=len(body.encode('utf-8')) if body else 0, error=(status_code is None) or (status_code >= 400),
+        )
+
+
 def aws_get(endpoint_url, base_url, params=None):
     return aws_request(method='GET', endpoint_url=endpoint_url, base_url=base_url, params=params)
 
@@ -846,4 +1908,12 @@ def aws_post(endpoint_url, base_url, params=None, request_body=None):
 
 def aws_patch(endpoint_url, base_url, request_body):
     return aws_request(method='PATCH', endpoint_url=endpoint_url, base_url=base_url, data=request_body)
+
+
+async def async_aws_get(endpoint_url, base_url, params=None):
+    return await async_aws_request(method='GET', endpoint_url=endpoint_url, base_url=base_url, params=params)
+
+
+async def async_aws_post(endpoint_url, base_url, params=None, request_body=None):
+    return await async_aws_request(method='POST', endpoint_url=endpoint_url, base_url=base_url, params=params, data=request_body)
 # endregion